@@ -0,0 +1,195 @@
+from sys import executable
+from os import environ
+from os.path import dirname, join
+from time import perf_counter
+from random import choices, randrange
+from asyncio import run, sleep, gather
+from argparse import ArgumentParser
+from subprocess import Popen, DEVNULL
+
+from httpx import AsyncClient, Limits, HTTPError
+from numpy import percentile
+from prometheus_client.parser import text_string_to_metric_families
+
+
+DIRECTORY = dirname(__file__)
+DEFAULT_MIX = "ccxt=30,ccxt-cached=15,coingecko=12,dominance=3,composite=10,fallback=5,stocks=10,forex=3,on-chain=4,indices=3,halving=1,coingecko-detail=2,stocks-detail=2"
+
+
+def leaf(ticker):
+	return ["var", [["ticker", ticker]]]
+
+def simple(ticker):
+	return {**ticker, "isSimple": True, "tree": leaf(ticker)}
+
+def exchange_ticker(exchangeId, base, quote="USDT"):
+	return {"id": base + quote, "name": base, "base": base, "quote": quote, "symbol": f"{base}/{quote}", "exchange": {"id": exchangeId, "name": exchangeId.capitalize()}, "image": None}
+
+def stock_ticker(symbol):
+	return {"id": symbol, "name": f"{symbol} Inc", "base": symbol, "quote": "USD", "symbol": symbol, "exchange": {"id": "nasdaq", "name": "NASDAQ"}, "image": None}
+
+def dominance_ticker(base):
+	return {"id": f"{base}.D", "name": base, "base": base, "quote": "", "symbol": f"{base}.D", "exchange": {}, "image": None}
+
+def quote(platforms, ticker):
+	return {"platforms": platforms, **{platform: {"ticker": simple(ticker)} for platform in platforms}}
+
+
+SCENARIOS = {
+	"ccxt": lambda i: ("/quote", quote(["CCXT"], exchange_ticker("benchmark", f"COIN{i}"))),
+	"ccxt-cached": lambda i: ("/quote", quote(["CCXT"], exchange_ticker("benchcache", f"COIN{i}"))),
+	"coingecko": lambda i: ("/quote", quote(["CoinGecko"], {"id": f"coin-{i}", "name": f"Coin {i}", "base": f"C{i}", "quote": "USD", "symbol": f"coin-{i}", "exchange": {}, "image": None})),
+	"dominance": lambda i: ("/quote", quote(["CoinGecko"], dominance_ticker(["BTC", "ETH", "USDT"][i % 3])) if i % 2 else {"platforms": ["CoinGecko"], "CoinGecko": {"ticker": {
+		"id": "BTC.D+ETH.D", "name": "BTC+ETH", "base": "BTC", "quote": "", "isSimple": False,
+		"tree": ["add", [leaf(dominance_ticker("BTC")), leaf(dominance_ticker("ETH"))]],
+	}}}),
+	"composite": lambda i: ("/quote", {"platforms": ["CCXT"], "CCXT": {"ticker": {
+		"id": f"COIN{i}USDT/ETHUSDT", "name": f"COIN{i}/ETH", "base": f"COIN{i}", "quote": "ETH", "isSimple": False,
+		"tree": ["div", [leaf(exchange_ticker("benchmark", f"COIN{i}")), leaf(exchange_ticker("benchmark", "ETH"))]],
+	}}}),
+	"fallback": lambda i: ("/quote", {"platforms": ["Twelvedata", "CCXT"], "Twelvedata": {"ticker": simple(stock_ticker(f"MISSING{i}"))}, "CCXT": {"ticker": simple(exchange_ticker("benchmark", f"COIN{i}"))}}),
+	"stocks": lambda i: ("/quote", quote(["Twelvedata"], stock_ticker(f"STK{i}"))),
+	"forex": lambda i: ("/quote", quote(["Twelvedata"], {"id": "EURUSD", "name": "EUR/USD", "base": "EUR", "quote": "USD", "symbol": "EUR/USD", "exchange": {"id": "forex", "name": "Forex"}, "image": None})),
+	"on-chain": lambda i: ("/quote", quote(["On-Chain"], {"id": f"0xpool{i}", "name": f"Pool {i}", "base": "BENCH", "quote": "WETH", "symbol": f"0xpool{i}", "exchange": {"id": "eth", "name": "Ethereum"}, "image": None})),
+	"indices": lambda i: ("/quote", quote(["Alternative.me"], {"id": "FGI", "name": "Fear & Greed Index", "base": "FGI", "quote": "", "symbol": "FGI", "exchange": {}, "image": None}) if i % 2 else quote(["CNN Business"], {"id": "FGI", "name": "Fear & Greed Index", "base": "FGI", "quote": "", "symbol": "FGI", "exchange": {}, "image": None})),
+	"halving": lambda i: ("/quote", quote(["Blockchair"], {"id": "BTC.HALVING", "name": "Bitcoin", "base": "BTC", "quote": "", "symbol": "BTC.HALVING", "exchange": {}, "image": None})),
+	"coingecko-detail": lambda i: ("/detail", {"platforms": ["CoinGecko"], "CoinGecko": {"ticker": {"id": f"coin-{i}", "name": f"Coin {i}", "base": f"C{i}", "quote": "USD", "symbol": f"coin-{i}", "exchange": {}}}}),
+	"stocks-detail": lambda i: ("/detail", {"platforms": ["Twelvedata"], "Twelvedata": {"ticker": stock_ticker(f"STK{i}")}}),
+}
+
+
+class Recorder(object):
+	def __init__(self):
+		self.samples = {}
+
+	def record(self, scenario, latency, outcome):
+		self.samples.setdefault(scenario, []).append((latency, outcome))
+
+	def reset(self):
+		self.samples = {}
+
+
+async def worker(client, recorder, scenarios, weights, symbols, deadline):
+	while perf_counter() < deadline:
+		scenario = choices(scenarios, weights)[0]
+		endpoint, body = SCENARIOS[scenario](randrange(symbols))
+		start = perf_counter()
+		try:
+			response = await client.post(endpoint, json=body)
+			outcome = "error" if response.status_code != 200 else ("ok" if response.json().get("response") else "empty")
+		except HTTPError:
+			outcome = "error"
+		recorder.record(scenario, perf_counter() - start, outcome)
+
+async def wait_until_ready(client, url):
+	for _ in range(300):
+		try:
+			await client.get(url)
+			return
+		except HTTPError:
+			await sleep(0.1)
+	raise RuntimeError(f"{url} did not come up")
+
+def summarize(name, samples, duration):
+	latencies = [latency * 1000 for latency, outcome in samples]
+	outcomes = [outcome for latency, outcome in samples]
+	p50, p95, p99 = percentile(latencies, [50, 95, 99]) if len(latencies) != 0 else (0, 0, 0)
+	return f"{name:<18}{len(samples):>8}{len(samples) / duration:>9.1f}{p50:>9.1f}{p95:>9.1f}{p99:>9.1f}{outcomes.count('empty'):>7}{outcomes.count('error'):>7}"
+
+def report(recorder, upstreamStats, duration):
+	requests = sum(len(samples) for samples in recorder.samples.values())
+	print(f"\n{'scenario':<18}{'requests':>8}{'rps':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'empty':>7}{'errors':>7}")
+	for scenario in sorted(recorder.samples):
+		print(summarize(scenario, recorder.samples[scenario], duration))
+	print(summarize("total", [sample for samples in recorder.samples.values() for sample in samples], duration))
+
+	# Time spent in each upstream stand-in, including injected latency, per request served
+	print(f"\n{'upstream':<18}{'calls':>8}{'per req':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>7}")
+	for upstream in sorted(upstreamStats):
+		latencies = [latency * 1000 for latency in upstreamStats[upstream]["latencies"]]
+		p50, p95, p99 = percentile(latencies, [50, 95, 99])
+		print(f"{upstream:<18}{len(latencies):>8}{len(latencies) / max(requests, 1):>9.2f}{p50:>9.1f}{p95:>9.1f}{p99:>9.1f}{upstreamStats[upstream]['errors']:>7}")
+
+def report_stages(metricsText):
+	# Server side stage timings from the histograms on /metrics, as observation counts and mean durations
+	print(f"\n{'stage':<34}{'labels':<34}{'count':>8}{'mean ms':>10}")
+	for family in text_string_to_metric_families(metricsText):
+		if family.type != "histogram" or not family.name.startswith("quote_server_"): continue
+		totals = {}
+		for sample in family.samples:
+			labels = ",".join(value for name, value in sorted(sample.labels.items()) if name != "le")
+			if sample.name.endswith("_count"): totals.setdefault(labels, [0, 0])[0] = sample.value
+			elif sample.name.endswith("_sum"): totals.setdefault(labels, [0, 0])[1] = sample.value
+		for labels, (count, total) in sorted(totals.items()):
+			if count == 0: continue
+			print(f"{family.name.replace('quote_server_', ''):<34}{labels[:33]:<34}{int(count):>8}{total / count * 1000:>10.3f}")
+
+async def main(arguments):
+	mix = dict((name, float(weight)) for name, weight in (item.split("=") for item in arguments.mix.split(",")))
+	serverUrl, upstreamUrl = f"http://127.0.0.1:{arguments.server_port}", f"http://127.0.0.1:{arguments.upstream_port}"
+
+	upstreams = Popen([executable, join(DIRECTORY, "upstreams.py"), "--port", str(arguments.upstream_port), "--fault", arguments.fault] + [argument for fault in arguments.upstream_fault for argument in ["--upstream-fault", fault]])
+	serverEnvironment = {
+		**environ,
+		"COINGECKO_API_KEY": "benchmark",
+		"TWELVEDATA_KEY": "benchmark",
+		"ELASTICSEARCH_API_KEY": "benchmark",
+		"COINGECKO_API_URL": upstreamUrl + "/coingecko/api/v3",
+		"TWELVEDATA_API_URL": upstreamUrl + "/twelvedata",
+		"ELASTICSEARCH_URL": upstreamUrl + "/elasticsearch",
+		"ALTERNATIVEME_API_URL": upstreamUrl + "/alternativeme",
+		"CNN_API_URL": upstreamUrl + "/cnn",
+		"BLOCKCHAIR_API_URL": upstreamUrl + "/blockchair",
+		"BENCHMARK_EXCHANGE_URL": upstreamUrl + "/exchange",
+		"CCXT_CACHE_MAP": '{"benchcache": "benchcache:s:"}',
+		# The stand-ins are not rate limited, so the limiter only shapes traffic when asked to through --env
+		"RATE_LIMITS": '{"CoinGecko": [100000, 100000], "Twelvedata": [100000, 100000], "CCXT": [100000, 100000]}',
+		**dict(item.split("=", 1) for item in arguments.env),
+	}
+	serverEnvironment.pop("PROXY_IP", None)
+	server = None
+
+	try:
+		async with AsyncClient(base_url=serverUrl, timeout=30, limits=Limits(max_connections=arguments.concurrency)) as client:
+			await wait_until_ready(client, upstreamUrl + "/_stats")
+			server = Popen([executable, join(DIRECTORY, "server.py"), "--port", str(arguments.server_port)], env=serverEnvironment, stdout=None if arguments.verbose else DEVNULL)
+			await wait_until_ready(client, serverUrl + "/metrics")
+
+			recorder = Recorder()
+			scenarios, weights = list(mix.keys()), list(mix.values())
+			if arguments.warmup > 0:
+				print(f"Warming up for {arguments.warmup} seconds")
+				deadline = perf_counter() + arguments.warmup
+				await gather(*[worker(client, recorder, scenarios, weights, arguments.symbols, deadline) for _ in range(arguments.concurrency)])
+				recorder.reset()
+				await client.post(upstreamUrl + "/_stats/reset")
+
+			print(f"Running {arguments.concurrency} clients for {arguments.duration} seconds")
+			start = perf_counter()
+			deadline = start + arguments.duration
+			await gather(*[worker(client, recorder, scenarios, weights, arguments.symbols, deadline) for _ in range(arguments.concurrency)])
+			duration = perf_counter() - start
+
+			report(recorder, (await client.get(upstreamUrl + "/_stats")).json(), duration)
+			report_stages((await client.get(serverUrl + "/metrics/")).text)
+	finally:
+		for process in [server, upstreams]:
+			if process is not None:
+				process.terminate()
+				process.wait()
+
+
+if __name__ == "__main__":
+	parser = ArgumentParser(description="Drives the quote server with a realistic request mix against local upstream stand-ins")
+	parser.add_argument("--duration", type=float, default=30)
+	parser.add_argument("--warmup", type=float, default=5)
+	parser.add_argument("--concurrency", type=int, default=32)
+	parser.add_argument("--symbols", type=int, default=50, help="Distinct symbols per scenario, lower values raise the cache hit rate")
+	parser.add_argument("--mix", default=DEFAULT_MIX, help="Comma separated scenario=weight pairs, from " + ", ".join(SCENARIOS))
+	parser.add_argument("--fault", default="20:5:0", help="Default upstream latency:jitter:errorRate, with latency and jitter in milliseconds")
+	parser.add_argument("--upstream-fault", action="append", default=[], help="Per upstream override, e.g. coingecko=200:50:0.05")
+	parser.add_argument("--env", action="append", default=[], help="Extra server environment, e.g. QUOTE_FANOUT_MODE=hedged")
+	parser.add_argument("--verbose", action="store_true", help="Show the quote server output, including tracebacks for injected failures")
+	parser.add_argument("--server-port", type=int, default=6900)
+	parser.add_argument("--upstream-port", type=int, default=6901)
+	run(main(parser.parse_args()))
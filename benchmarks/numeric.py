@@ -0,0 +1,52 @@
+from sys import path
+from os.path import dirname, join
+from time import time
+from random import random
+from timeit import timeit
+
+path.insert(0, join(dirname(__file__), "..", "src"))
+
+from helpers.candles import CandleBuffer
+from helpers.numeric import to_array, highest, lowest, HIGH, LOW
+
+
+ROUNDS = 2000
+
+
+def make_candles(count, interval):
+	now = int(time()) * 1000
+	return [[now - (count - i) * interval, random(), random(), random(), random(), random()] for i in range(count)]
+
+def list_volume(rawData, now):
+	return sum([candle[5] for candle in rawData if int(candle[0] / 1000) >= int(now / 1000) - 86400])
+
+def list_extremes(historicData):
+	highs = [e[2] for e in historicData]
+	lows = [e[3] for e in historicData]
+	return max(highs), min(lows)
+
+def array_extremes(historicData):
+	historicData = to_array(historicData, 5)
+	return highest(historicData[:, HIGH]), lowest(historicData[:, LOW])
+
+def report(name, baseline, vectorized):
+	print(f"{name:<32}{baseline * 1e6 / ROUNDS:>10.1f} us{vectorized * 1e6 / ROUNDS:>10.1f} us{baseline / vectorized:>8.1f}x")
+
+
+if __name__ == "__main__":
+	now = int(time()) * 1000
+	rawData = make_candles(150, 600000)
+	buffer = CandleBuffer()
+	buffer.merge(rawData)
+	latest = [rawData[-1]]
+
+	def buffered_volume():
+		buffer.merge(latest)
+		return buffer.summary(now - 86400000, 2)
+
+	# CoinGecko returns 4 day candles for a 365 day range
+	historicData = [candle[:5] for candle in make_candles(92, 345600000)]
+
+	print(f"{'':<32}{'lists':>13}{'numpy':>13}{'gain':>9}")
+	report("24h volume over 150 candles", timeit(lambda: list_volume(rawData, now), number=ROUNDS), timeit(buffered_volume, number=ROUNDS))
+	report("1y high and low over OHLC", timeit(lambda: list_extremes(historicData), number=ROUNDS), timeit(lambda: array_extremes(historicData), number=ROUNDS))
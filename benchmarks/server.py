@@ -0,0 +1,54 @@
+from sys import path
+from os import environ
+from os.path import dirname, join
+from argparse import ArgumentParser
+from urllib.parse import urlencode
+
+path.insert(0, join(dirname(__file__), "..", "src"))
+
+import ccxt.async_support as ccxtAsync
+from uvicorn import Config, Server
+
+
+class benchmark(ccxtAsync.Exchange):
+	def describe(self):
+		return self.deep_extend(super(benchmark, self).describe(), {
+			"id": "benchmark",
+			"name": "Benchmark",
+			"enableRateLimit": False,
+			"has": {"fetchOHLCV": True},
+			"timeframes": {"1m": "1m", "1h": "1h"},
+			"urls": {"api": {"public": environ["BENCHMARK_EXCHANGE_URL"]}},
+		})
+
+	async def fetch_markets(self, params={}):
+		symbols = await self.fetch(self.urls["api"]["public"] + "/markets")
+		markets = []
+		for symbol in symbols:
+			base, quote = symbol.split("/")
+			markets.append(self.safe_market_structure({"id": base + quote, "symbol": symbol, "base": base, "quote": quote, "baseId": base, "quoteId": quote, "active": True, "type": "spot", "spot": True}))
+		return markets
+
+	async def fetch_ohlcv(self, symbol, timeframe="1m", since=None, limit=None, params={}):
+		return await self.fetch(self.urls["api"]["public"] + "/ohlcv?" + urlencode({"symbol": symbol, "timeframe": timeframe, "since": since or 0, "limit": limit or 150}))
+
+
+class benchcache(benchmark):
+	# Tickers on this exchange are looked up in the cache index first
+	def describe(self):
+		return self.deep_extend(super(benchcache, self).describe(), {"id": "benchcache", "name": "Benchmark Cache"})
+
+
+if __name__ == "__main__":
+	parser = ArgumentParser(description="Runs the quote server against the local upstream stand-ins")
+	parser.add_argument("--port", type=int, default=6900)
+	arguments = parser.parse_args()
+
+	for exchange in [benchmark, benchcache]:
+		setattr(ccxtAsync, exchange.__name__, exchange)
+		ccxtAsync.exchanges.append(exchange.__name__)
+
+	import quote_server
+
+	server = Server(Config(app=quote_server.app, port=arguments.port, host="127.0.0.1", log_level="warning"))
+	quote_server.loop.run_until_complete(server.serve())
@@ -0,0 +1,97 @@
+from sys import executable
+from os import environ
+from os.path import dirname, join
+from time import sleep
+from statistics import median
+from argparse import ArgumentParser
+from subprocess import Popen, run, PIPE
+
+from httpx import get, HTTPError
+
+
+DIRECTORY = dirname(__file__)
+SOURCE = join(DIRECTORY, "..", "src")
+
+# Imports the server the way a fresh pod does, then optionally loads providers, timing each step.
+PROBE = """
+from time import perf_counter
+
+startedAt = perf_counter()
+import quote_server
+print("import", perf_counter() - startedAt)
+for platform in {platforms}:
+	startedAt = perf_counter()
+	quote_server.providers.import_provider(platform)
+	print("load " + platform, perf_counter() - startedAt)
+"""
+
+
+def wait_until_ready(url):
+	for _ in range(100):
+		try:
+			get(url)
+			return
+		except HTTPError:
+			sleep(0.1)
+	raise RuntimeError(f"{url} did not become ready")
+
+def server_imports(stderr, count):
+	# Lists what quote_server imports directly, plus anything loaded after it, with cumulative times
+	modules, children, seenServer = [], [], False
+	for line in stderr.splitlines():
+		if not line.startswith("import time:") or "cumulative" in line: continue
+		_, cumulative, name = line.split("|")
+		depth = (len(name) - len(name.lstrip(" "))) // 2
+		entry = (int(cumulative) / 1000, name.strip())
+		if depth == 1:
+			children.append(entry)
+		elif depth == 0:
+			if name.strip() == "quote_server":
+				modules.extend(children)
+				seenServer = True
+			elif seenServer:
+				modules.append(entry)
+			children = []
+	return sorted(modules, reverse=True)[:count]
+
+if __name__ == "__main__":
+	parser = ArgumentParser(description="Measures how long a fresh process takes to import the quote server and load providers")
+	parser.add_argument("--runs", type=int, default=5)
+	parser.add_argument("--upstream-port", type=int, default=6901)
+	parser.add_argument("--provider", action="append", default=[], help="Provider to load after the import, e.g. CCXT")
+	parser.add_argument("--top", type=int, default=12)
+	arguments = parser.parse_args()
+
+	upstreamUrl = f"http://127.0.0.1:{arguments.upstream_port}"
+	upstreams = Popen([executable, join(DIRECTORY, "upstreams.py"), "--port", str(arguments.upstream_port)])
+	serverEnvironment = {
+		**environ,
+		"COINGECKO_API_KEY": "benchmark",
+		"TWELVEDATA_KEY": "benchmark",
+		"ELASTICSEARCH_API_KEY": "benchmark",
+		"COINGECKO_API_URL": upstreamUrl + "/coingecko/api/v3",
+		"TWELVEDATA_API_URL": upstreamUrl + "/twelvedata",
+		"ELASTICSEARCH_URL": upstreamUrl + "/elasticsearch",
+	}
+	serverEnvironment.pop("PROXY_IP", None)
+
+	try:
+		wait_until_ready(upstreamUrl + "/_stats")
+		timings, stderr = {}, ""
+		for _ in range(arguments.runs):
+			result = run([executable, "-X", "importtime", "-c", PROBE.format(platforms=arguments.provider)], cwd=SOURCE, env=serverEnvironment, stdout=PIPE, stderr=PIPE, text=True, check=True)
+			for line in result.stdout.splitlines():
+				step, seconds = line.rsplit(" ", 1)
+				timings.setdefault(step, []).append(float(seconds) * 1000)
+			stderr = result.stderr
+	finally:
+		upstreams.terminate()
+		upstreams.wait()
+
+	print(f"{'step':<28}{'median ms':>12}{'min ms':>10}")
+	for step, samples in timings.items():
+		print(f"{step:<28}{median(samples):>12.1f}{min(samples):>10.1f}")
+
+	print(f"\n{'server import':<48}{'ms':>10}")
+	for milliseconds, name in server_imports(stderr, arguments.top):
+		print(f"{name:<48}{milliseconds:>10.1f}")
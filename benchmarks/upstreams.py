@@ -0,0 +1,275 @@
+from time import time, perf_counter
+from zlib import crc32
+from random import random, gauss
+from asyncio import sleep
+from argparse import ArgumentParser
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from uvicorn import Config, Server
+
+
+DAY = 86400000
+
+
+class Fault(object):
+	def __init__(self, latency, jitter, errorRate):
+		self.latency = latency
+		self.jitter = jitter
+		self.errorRate = errorRate
+
+	@staticmethod
+	def parse(text):
+		latency, jitter, errorRate = (text.split(":") + ["0", "0"])[:3]
+		return Fault(float(latency), float(jitter), float(errorRate))
+
+	async def apply(self):
+		delay = max(0, gauss(self.latency, self.jitter)) / 1000
+		if delay > 0: await sleep(delay)
+		return random() < self.errorRate
+
+
+app = FastAPI()
+app.state.defaultFault = Fault(0, 0, 0)
+app.state.faults = {}
+app.state.stats = {}
+
+
+def base_price(symbol):
+	# Prices are stable per symbol so responses from different upstreams agree with each other
+	return 1 + crc32(symbol.encode()) % 50000
+
+def wobble(price):
+	return price * (1 + (random() - 0.5) / 100)
+
+def upstream_of(path):
+	return path.strip("/").split("/", 1)[0]
+
+
+@app.middleware("http")
+async def inject_faults(request: Request, call_next):
+	upstream = upstream_of(request.url.path)
+	if upstream == "_stats":
+		return await call_next(request)
+
+	start = perf_counter()
+	failed = await app.state.faults.get(upstream, app.state.defaultFault).apply()
+	if failed:
+		response = JSONResponse({"status": "error", "code": 500, "message": "Injected failure"}, status_code=500)
+	else:
+		response = await call_next(request)
+	if upstream == "elasticsearch":
+		response.headers["X-Elastic-Product"] = "Elasticsearch"
+
+	stats = app.state.stats.setdefault(upstream, {"latencies": [], "errors": 0})
+	stats["latencies"].append(perf_counter() - start)
+	if failed: stats["errors"] += 1
+	return response
+
+@app.get("/_stats")
+async def get_stats():
+	return app.state.stats
+
+@app.post("/_stats/reset")
+async def reset_stats():
+	app.state.stats = {}
+	return {}
+
+
+@app.get("/coingecko/api/v3/global")
+async def coingecko_global():
+	return {"data": {"market_cap_percentage": {"btc": wobble(52), "eth": wobble(17), "usdt": wobble(4)}}}
+
+@app.get("/coingecko/api/v3/simple/price")
+async def coingecko_simple_price(ids: str, vs_currencies: str):
+	response = {}
+	for coinId in ids.split(","):
+		price = wobble(base_price(coinId))
+		response[coinId] = {}
+		for currency in vs_currencies.split(","):
+			response[coinId][currency] = price
+			response[coinId][f"{currency}_24h_vol"] = price * 1000
+			response[coinId][f"{currency}_24h_change"] = random() * 10 - 5
+	return response
+
+@app.get("/coingecko/api/v3/coins/markets")
+async def coingecko_markets(vs_currency: str, ids: str):
+	response = []
+	for coinId in ids.split(","):
+		price = wobble(base_price(coinId))
+		response.append({
+			"id": coinId,
+			"current_price": price,
+			"market_cap": price * 1e7,
+			"market_cap_rank": 1 + crc32(coinId.encode()) % 500,
+			"total_volume": price * 1000,
+			"ath": price * 2,
+			"atl": price / 10,
+			"total_supply": 21000000,
+			"circulating_supply": 19000000,
+			"price_change_percentage_24h_in_currency": random() * 10 - 5,
+			"price_change_percentage_30d_in_currency": random() * 40 - 20,
+			"price_change_percentage_1y_in_currency": random() * 200 - 100,
+		})
+	return response
+
+@app.get("/coingecko/api/v3/coins/{coinId}/ohlc")
+async def coingecko_ohlc(coinId: str, days: int = 365):
+	price, now = base_price(coinId), int(time() * 1000)
+	return [[now - i * 4 * DAY, wobble(price), wobble(price) * 1.05, wobble(price) * 0.95, wobble(price)] for i in range(days // 4, 0, -1)]
+
+@app.get("/coingecko/api/v3/coins/{coinId}")
+@app.get("/coingecko/api/v3/coins/{coinId}/")
+async def coingecko_coin(coinId: str):
+	price = wobble(base_price(coinId))
+	currencies = {"usd": 1, "eur": 0.9, "btc": 0.00002}
+	return {
+		"id": coinId,
+		"name": coinId.capitalize(),
+		"description": {"en": "<p>" + "A benchmark asset. " * 40 + "</p>\r\n\r\n<p>" + "More detail. " * 40 + "</p>"},
+		"image": {"large": f"https://assets.example.com/{coinId}.png"},
+		"links": {"homepage": [f"https://{coinId}.example.com"]},
+		"market_data": {
+			"current_price": {currency: price * rate for currency, rate in currencies.items()},
+			"total_volume": {currency: price * rate * 1000 for currency, rate in currencies.items()},
+			"market_cap": {"usd": price * 1e7},
+			"market_cap_rank": 1 + crc32(coinId.encode()) % 500,
+			"ath": {"usd": price * 2},
+			"atl": {"usd": price / 10},
+			"price_change_percentage_24h_in_currency": {currency: random() * 10 - 5 for currency in currencies},
+			"price_change_percentage_30d_in_currency": {"usd": random() * 40 - 20},
+			"price_change_percentage_1y_in_currency": {"usd": random() * 200 - 100},
+			"total_supply": 21000000,
+			"circulating_supply": 19000000,
+		},
+	}
+
+@app.get("/coingecko/api/v3/onchain/networks/{network}/pools/{pool}")
+async def coingecko_pool(network: str, pool: str):
+	price = wobble(base_price(pool)) / 1000
+	return {"data": {"attributes": {
+		"name": "BENCH / WETH 0.3%",
+		"base_token_price_usd": str(price),
+		"base_token_price_native_currency": str(price / 3000),
+		"volume_usd": {"h24": str(price * 1e6)},
+		"price_change_percentage": {"h24": str(round(random() * 10 - 5, 2))},
+	}}}
+
+
+def twelvedata_series(symbol, outputsize):
+	price = base_price(symbol)
+	return {
+		"meta": {"symbol": symbol, "interval": "1day"},
+		"values": [{
+			"datetime": f"2024-01-{31 - i:02d}",
+			"open": str(wobble(price)),
+			"high": str(wobble(price) * 1.02),
+			"low": str(wobble(price) * 0.98),
+			"close": str(wobble(price)),
+			"volume": str(int(price * 100)),
+		} for i in range(outputsize)],
+		"status": "ok",
+	}
+
+@app.get("/twelvedata/technical_indicators")
+async def twelvedata_indicators():
+	return {"data": {}, "status": "ok"}
+
+@app.get("/twelvedata/time_series")
+async def twelvedata_time_series(symbol: str, outputsize: int = 30):
+	if "," not in symbol:
+		if symbol.startswith("MISSING"): return {"status": "error", "code": 404, "message": f"{symbol} not found"}
+		return twelvedata_series(symbol, outputsize)
+	return {name: twelvedata_series(name.split(":")[0], outputsize) for name in symbol.split(",") if not name.startswith("MISSING")}
+
+@app.get("/twelvedata/exchange_rate")
+async def twelvedata_exchange_rate(symbol: str):
+	return {"symbol": symbol, "rate": wobble(1.08), "timestamp": int(time())}
+
+@app.get("/twelvedata/logo")
+async def twelvedata_logo(symbol: str):
+	return {"meta": {"symbol": symbol}, "url": f"https://logos.example.com/{symbol}.png"}
+
+@app.get("/twelvedata/profile")
+async def twelvedata_profile(symbol: str):
+	return {
+		"symbol": symbol,
+		"name": f"{symbol} Inc",
+		"description": "A benchmark company.",
+		"industry": "Benchmarks",
+		"website": f"https://{symbol.lower()}.example.com",
+		"employees": 1000,
+		"address": "1 Example Street",
+		"city": "Example",
+		"state": "EX",
+		"country": "United States",
+	}
+
+@app.get("/twelvedata/statistics")
+async def twelvedata_statistics(symbol: str):
+	price = base_price(symbol)
+	return {"meta": {"symbol": symbol}, "statistics": {
+		"stock_price_summary": {"fifty_two_week_high": price * 1.3, "fifty_two_week_low": price * 0.7, "fifty_two_week_change": 0.12, "beta": 1.1},
+		"valuations_metrics": {"market_capitalization": price * 1e9, "enterprise_value": price * 1.1e9, "trailing_pe": 25, "forward_pe": 22, "peg_ratio": 1.5, "price_to_sales_ttm": 6, "price_to_book_mrq": 30, "enterprise_to_revenue": 6.5, "enterprise_to_ebitda": 18},
+		"financials": {"profit_margin": 0.25, "operating_margin": 0.3, "return_on_assets_ttm": 0.2, "return_on_equity_ttm": 1.5},
+	}, "status": "ok"}
+
+
+@app.get("/elasticsearch/")
+async def elasticsearch_info():
+	return {"name": "benchmark", "cluster_name": "benchmark", "version": {"number": "8.19.0"}, "tagline": "You Know, for Search"}
+
+def cache_document(docId):
+	price = base_price(docId.rsplit(":", 1)[-1])
+	return {"open": wobble(price), "close": wobble(price), "volume": price * 1000}
+
+@app.get("/elasticsearch/cache/_doc/{docId}")
+async def elasticsearch_get(docId: str):
+	if "MISSING" in docId:
+		return JSONResponse({"_index": "cache", "_id": docId, "found": False}, status_code=404)
+	return {"_index": "cache", "_id": docId, "found": True, "_source": cache_document(docId)}
+
+@app.post("/elasticsearch/cache/_mget")
+async def elasticsearch_mget(request: Request):
+	body = await request.json()
+	return {"docs": [{"_index": "cache", "_id": docId, "found": False} if "MISSING" in docId else {"_index": "cache", "_id": docId, "found": True, "_source": cache_document(docId)} for docId in body["ids"]]}
+
+
+@app.get("/exchange/markets")
+async def exchange_markets(count: int = 200):
+	return [f"COIN{i}/USDT" for i in range(count)] + ["BTC/USDT", "ETH/USDT"]
+
+@app.get("/exchange/ohlcv")
+async def exchange_ohlcv(symbol: str, timeframe: str, since: int = 0, limit: int = 150):
+	interval = 60000 if timeframe == "1m" else 3600000
+	price, now = base_price(symbol), int(time() * 1000) // interval * interval
+	start = max(since // interval * interval, now - (limit - 1) * interval)
+	return [[timestamp, wobble(price), wobble(price) * 1.01, wobble(price) * 0.99, wobble(price), price * 10] for timestamp in range(start, now + 1, interval)]
+
+
+@app.get("/alternativeme/fng/")
+async def alternativeme_index():
+	return {"data": [{"value": "55", "value_classification": "Greed"}, {"value": "50", "value_classification": "Neutral"}]}
+
+@app.get("/cnn/index/fearandgreed/graphdata")
+async def cnn_index():
+	return {"fear_and_greed": {"score": 55.4, "rating": "greed", "previous_close": 50.2}}
+
+@app.get("/blockchair/tools/halvening")
+async def blockchair_halvening():
+	return {"data": {"bitcoin": {"halvening_time": "2028-04-20 00:00:00"}, "bitcoin-cash": {"halvening_time": "2028-03-30 00:00:00"}}}
+
+
+if __name__ == "__main__":
+	parser = ArgumentParser(description="Local stand-ins for every upstream the quote server calls")
+	parser.add_argument("--port", type=int, default=6901)
+	parser.add_argument("--fault", default="0:0:0", help="Default latency:jitter:errorRate, with latency and jitter in milliseconds")
+	parser.add_argument("--upstream-fault", action="append", default=[], help="Per upstream override, e.g. coingecko=200:50:0.05")
+	arguments = parser.parse_args()
+
+	app.state.defaultFault = Fault.parse(arguments.fault)
+	for override in arguments.upstream_fault:
+		upstream, fault = override.split("=", 1)
+		app.state.faults[upstream] = Fault.parse(fault)
+
+	Server(Config(app=app, port=arguments.port, host="127.0.0.1", log_level="warning")).run()
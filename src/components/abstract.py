@@ -1,108 +1,166 @@
-from time import time
-from abc import ABCMeta, abstractmethod
-from random import random
+from os import environ
+from time import time, perf_counter
+from asyncio import gather, Semaphore
+from functools import partial
+from abc import ABCMeta
 from orjson import dumps, OPT_SORT_KEYS
-from traceback import format_exc
-
-from lark import Tree, Token, Transformer, v_args
+from traceback import format_exc, format_exception
 
+from helpers.expressions import compile_expression
+from helpers.executors import run_in_executor
+from helpers import metrics
 from assets import static_storage
 
 
+DEFAULT_EXCHANGE_CONCURRENCY = int(environ.get("EXCHANGE_CONCURRENCY", 4))
+EXCHANGE_CONCURRENCY = {
+	"htx": 2,
+	"bitmex": 2,
+}
+exchangeLimits = {}
+
+
+async def gather_quotes(requests):
+	# A ticker that fails answers empty, so it falls through to its next platform instead of failing everything batched with it
+	results = []
+	for result in await gather(*requests, return_exceptions=True):
+		if isinstance(result, Exception):
+			print("".join(format_exception(result)))
+			result = (None, None)
+		elif isinstance(result, BaseException):
+			raise result
+		results.append(result)
+	return results
+
+
 class AbstractProvider(object):
 	__metaclass__ = ABCMeta
 
 	@classmethod
-	def request_quote(cls, request, **kwargs):
+	async def request_quote_async(cls, request, **kwargs):
 		ticker = request.get("ticker")
 		tree = ticker.pop("tree")
 		if tree is None: return None, None
 
-		tickerTree = cls.build_tree(tree)
-
-		if not ticker.get("isSimple"):
-			priceCalculatorTree = AbstractProvider.CalculateTree(cls, request, "quotePrice", **kwargs)
-			try:
-				price = priceCalculatorTree.transform(tickerTree)
-			except ZeroDivisionError:
-				price = 0
-			except:
-				print(format_exc())
-				return None, priceCalculatorTree.error
-
-			if priceCalculatorTree.error is not None:
-				return None, priceCalculatorTree.error
-
-			volumeCalculatorTree = AbstractProvider.CalculateTree(cls, request, "quoteVolume", **kwargs)
-			volumeCalculatorTree.vars = priceCalculatorTree.vars
-
-			try:
-				volume = volumeCalculatorTree.transform(tickerTree)
-			except ZeroDivisionError:
-				volume = 0
-			except:
-				print(format_exc())
-				return None, priceCalculatorTree.error
-
-			if volumeCalculatorTree.error is not None:
-				return None, volumeCalculatorTree.error
-
-			payload = {
-				"quotePrice": "{:,.8f}".format(price).rstrip("0").rstrip("."),
-				"quoteVolume": "{:,.8f}".format(volume).rstrip("0").rstrip("."),
-				"title": ticker.get("name"),
-				"thumbnailUrl": static_storage.icon,
-				"messageColor": "amber",
-				"sourceText": "Data provided by Alpha.bot",
-				"platform": "Alpha.bot",
-				"raw": {
-					"quotePrice": [price],
-					"quoteVolume": [volume],
-					"timestamp": time()
-				}
+		if ticker.get("isSimple"):
+			return await cls._request_quote_observed(request, ticker, **kwargs)
+
+		try:
+			expression = cls._compile(tree)
+		except:
+			print(format_exc())
+			return None, None
+
+		# Distinct leaves go through the provider's grouped call, falling back to concurrent single lookups, so a composite quote takes about as long as its slowest leaf
+		leaves = expression.leaves
+		responses = dict(zip(leaves.keys(), await cls._request_quote_batch_async([(request, leaf) for leaf in leaves.values()], **kwargs)))
+
+		return cls.evaluate_leaves(ticker, expression, responses)
+
+	@classmethod
+	async def request_quote_batch_async(cls, requests, **kwargs):
+		# Simple tickers and the leaves of composite ones are deduplicated and fetched in one grouped call
+		units, plans = {}, []
+		for request in requests:
+			ticker = request.get("ticker")
+			tree = ticker.pop("tree")
+			if tree is None:
+				plans.append(None)
+			elif ticker.get("isSimple"):
+				hashName = dumps(ticker, option=OPT_SORT_KEYS)
+				units.setdefault(hashName, (request, ticker))
+				plans.append((hashName, None))
+			else:
+				try:
+					expression = cls._compile(tree)
+				except:
+					print(format_exc())
+					plans.append(None)
+					continue
+				for hashName, leaf in expression.leaves.items():
+					units.setdefault(hashName, (request, leaf))
+				plans.append((None, expression))
+
+		responses = dict(zip(units.keys(), await cls._request_quote_batch_async(list(units.values()), **kwargs)))
+
+		results = []
+		for request, plan in zip(requests, plans):
+			if plan is None:
+				results.append((None, None))
+			elif plan[0] is not None:
+				results.append(responses[plan[0]])
+			else:
+				results.append(cls.evaluate_leaves(request.get("ticker"), plan[1], responses))
+		return results
+
+	@classmethod
+	def evaluate_leaves(cls, ticker, expression, responses):
+		variables = {}
+		for hashName in expression.leaves:
+			[response, quoteMessage] = responses[hashName]
+			if not bool(response) or quoteMessage is not None:
+				return None, quoteMessage
+			variables[hashName] = response["raw"]
+
+		try:
+			with metrics.treeEvaluateSeconds.labels(cls.name).time():
+				price, volume = expression.evaluate(variables)
+		except:
+			print(format_exc())
+			return None, None
+
+		payload = {
+			"quotePrice": "{:,.8f}".format(price).rstrip("0").rstrip("."),
+			"quoteVolume": "{:,.8f}".format(volume).rstrip("0").rstrip("."),
+			"title": ticker.get("name"),
+			"thumbnailUrl": static_storage.icon,
+			"messageColor": "amber",
+			"sourceText": "Data provided by Alpha.bot",
+			"platform": "Alpha.bot",
+			"raw": {
+				"quotePrice": [price],
+				"quoteVolume": [volume],
+				"timestamp": time()
 			}
-			quoteMessage = None
-		else:
-			[payload, quoteMessage] = cls._request_quote(request, ticker, **kwargs)
+		}
+		return payload, None
 
-		return payload, quoteMessage
+	@classmethod
+	def _compile(cls, tree):
+		with metrics.treeCompileSeconds.labels(cls.name).time():
+			return compile_expression(tree)
 
 	@classmethod
-	@abstractmethod
 	def _request_quote(cls, request, ticker, **kwargs):
 		raise NotImplementedError
 
-	@v_args(inline=True)
-	class CalculateTree(Transformer):
-		from operator import add, sub, mul, truediv as div, neg
-		number = float
-		exp = pow
-
-		def __init__(self, cls, request, requestType, **kwargs):
-			self.cls = cls
-			self.request = request
-			self.requestType = requestType
-			self.kwargs = kwargs
-			self.vars = {}
-			self.error = None
-
-		def assign_var(self, name, value):
-			self.vars[name] = value
-			return value
-
-		def var(self, name):
-			hashName = dumps(name.value, option=OPT_SORT_KEYS)
-			try:
-				return self.vars[hashName][self.requestType][0]
-			except KeyError:
-				[response, quoteMessage] = self.cls._request_quote(self.request, name.value, **self.kwargs)
-				if not bool(response) or quoteMessage is not None:
-					self.error = quoteMessage
-					return random()
-				else:
-					return self.assign_var(hashName, response["raw"]).get(self.requestType, [0])[0]
+	@classmethod
+	async def _request_quote_async(cls, request, ticker, **kwargs):
+		# Providers built on a blocking SDK only implement _request_quote, which runs on their own executor
+		return await run_in_executor(cls.name, partial(cls._request_quote, request, ticker, **kwargs))
+
+	@classmethod
+	async def _request_quote_batch_async(cls, items, **kwargs):
+		# Providers without a bulk upstream endpoint fetch each ticker on its own
+		return await gather_quotes([cls._request_quote_limited(request, ticker, **kwargs) for request, ticker in items])
+
+	@classmethod
+	async def _request_quote_limited(cls, request, ticker, **kwargs):
+		exchange = ticker.get("exchange") or {}
+		# Providers without an exchange are already bounded by their platform bulkhead, so they do not share one tiny semaphore
+		if not exchange.get("id"):
+			return await cls._request_quote_observed(request, ticker, **kwargs)
+		key = (cls.__name__, exchange.get("id"))
+		if key not in exchangeLimits:
+			exchangeLimits[key] = Semaphore(EXCHANGE_CONCURRENCY.get(exchange.get("id"), DEFAULT_EXCHANGE_CONCURRENCY))
+		async with exchangeLimits[key]:
+			return await cls._request_quote_observed(request, ticker, **kwargs)
 
 	@classmethod
-	def build_tree(cls, l):
-		if l[0] in ["CONSTANT", "NAME", "QUOTED"]: return Token(l[0], l[1])
-		else: return Tree(l[0], [cls.build_tree(e) for e in l[1]])
\ No newline at end of file
+	async def _request_quote_observed(cls, request, ticker, **kwargs):
+		exchange = ticker.get("exchange") or {}
+		startedAt = perf_counter()
+		try:
+			return await cls._request_quote_async(request, ticker, **kwargs)
+		finally:
+			metrics.providerRequestSeconds.labels(cls.name, exchange.get("id") or "").observe(perf_counter() - startedAt)
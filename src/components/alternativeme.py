@@ -1,16 +1,38 @@
+from os import environ
 from time import time
-from requests import get
+from traceback import format_exc
 
 from components.abstract import AbstractProvider
+from helpers.providers import register, QUOTE
+from helpers.snapshots import snapshots
+from helpers import http
 from assets import static_storage
 
 
+FEAR_GREED_URL = environ.get("ALTERNATIVEME_API_URL", "https://api.alternative.me") + "/fng/?limit=2&format=json"
+
+
+@register([QUOTE])
 class Alternativeme(AbstractProvider):
 	name = "Alternative.me"
 
 	@classmethod
-	def _request_quote(cls, request, ticker):
-		r = get("https://api.alternative.me/fng/?limit=2&format=json").json()
+	async def _request_quote_async(cls, request, ticker):
+		try:
+			r = await snapshots.get(Alternativeme.name)
+		except:
+			print(format_exc())
+			return None, None
+		return Alternativeme._parse_quote(r)
+
+	@staticmethod
+	async def _fetch_index():
+		response = await http.get(FEAR_GREED_URL)
+		response.raise_for_status()
+		return response.json()
+
+	@staticmethod
+	def _parse_quote(r):
 		fearGreedIndex = int(r["data"][0]["value"])
 
 		payload = {
@@ -27,4 +49,7 @@ class Alternativeme(AbstractProvider):
 				"timestamp": time()
 			}
 		}
-		return payload, None
\ No newline at end of file
+		return payload, None
+
+
+snapshots.register(Alternativeme.name, Alternativeme._fetch_index, interval=600)
@@ -1,46 +1,68 @@
+from os import environ
 from time import time
 from datetime import datetime, timezone
-from requests import get
+from traceback import format_exc
 
 from components.abstract import AbstractProvider
+from helpers.providers import register, QUOTE
+from helpers.snapshots import snapshots
+from helpers import http
 from assets import static_storage
 
 
+HALVENING_URL = environ.get("BLOCKCHAIR_API_URL", "https://api.blockchair.com") + "/tools/halvening"
 CCXT_TO_BLOCKCHAIR = {
 	"BTC": "bitcoin",
 	"BCH": "bitcoin-cash"
 }
 
 
+@register([QUOTE])
 class Blockchair(AbstractProvider):
 	name = "Blockchair"
 
 	@classmethod
-	def _request_quote(cls, request, ticker):
-		tickerId = ticker.get("id")
-
-		if tickerId.endswith(".HALVING"):
-			r = get("https://api.blockchair.com/tools/halvening").json()
-			asset = CCXT_TO_BLOCKCHAIR[ticker.get("base")]
-			rawData = r["data"][asset]
-
-			halvingTime = datetime.strptime(rawData["halvening_time"], "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc)
-
-			payload = {
-				"quotePrice": f"≈ <t:{int(datetime.timestamp(halvingTime))}:R>",
-				"quoteConvertedPrice": f"≈ <t:{int(datetime.timestamp(halvingTime))}>",
-				"title": f"{ticker.get('name')} Halving",
-				"thumbnailUrl": ticker.get("image"),
-				"messageColor": "deep purple",
-				"sourceText": "Data provided by Blockchair",
-				"platform": Blockchair.name,
-				"raw": {
-					"quotePrice": [int(datetime.timestamp(halvingTime))],
-					"timestamp": time()
-				}
+	async def _request_quote_async(cls, request, ticker):
+		if ticker.get("id").endswith(".HALVING"):
+			try:
+				r = await snapshots.get(Blockchair.name)
+			except:
+				print(format_exc())
+				return None, None
+			return Blockchair._parse_halving(ticker, r)
+
+		else:
+			return None, None
+
+	@staticmethod
+	async def _fetch_halvening():
+		response = await http.get(HALVENING_URL)
+		response.raise_for_status()
+		return response.json()
+
+	@staticmethod
+	def _parse_halving(ticker, r):
+		asset = CCXT_TO_BLOCKCHAIR.get(ticker.get("base"))
+		if asset is None or asset not in r["data"]: return None, f"Halving data for {ticker.get('base')} is not available."
+		rawData = r["data"][asset]
+
+		halvingTime = datetime.strptime(rawData["halvening_time"], "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc)
+
+		payload = {
+			"quotePrice": f"≈ <t:{int(datetime.timestamp(halvingTime))}:R>",
+			"quoteConvertedPrice": f"≈ <t:{int(datetime.timestamp(halvingTime))}>",
+			"title": f"{ticker.get('name')} Halving",
+			"thumbnailUrl": ticker.get("image"),
+			"messageColor": "deep purple",
+			"sourceText": "Data provided by Blockchair",
+			"platform": Blockchair.name,
+			"raw": {
+				"quotePrice": [int(datetime.timestamp(halvingTime))],
+				"timestamp": time()
 			}
+		}
 
-			return payload, None
+		return payload, None
 
-		else:
-			return None, None
\ No newline at end of file
+
+snapshots.register(Blockchair.name, Blockchair._fetch_halvening, interval=300)
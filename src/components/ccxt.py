@@ -4,212 +4,295 @@ from math import ceil
 from datetime import datetime, timezone
 from traceback import format_exc
 
-from elasticsearch import Elasticsearch
+from orjson import loads
 
-from components.abstract import AbstractProvider
-import ccxt
-from ccxt.base.errors import NotSupported, BadSymbol
+from components.abstract import AbstractProvider, gather_quotes
+from helpers.providers import register, QUOTE, BATCH
+# Importing through ccxt.async_support loads the exchange classes while the provider itself is loaded, off the event loop
+from ccxt.async_support import NotSupported, BadSymbol
+from helpers.exchanges import asyncExchangePool
+from helpers.ratelimits import get_limiter
+from helpers.candles import candleStore
+from helpers import cache_index
 from assets import static_storage
 
 
-elasticsearch = Elasticsearch(
-	cloud_id=environ["ELASTICSEARCH_CLOUD_ID"],
-	api_key=environ["ELASTICSEARCH_API_KEY"],
-)
-
-
-PROXY_BLACKLIST = ["htx"]
 CCXT_TO_CACHE_MAP = {
 	"binance": "binance:s:",
 	"binanceusdm": "binance:f:",
 	"binancecoinm": "binance:i:",
+	**loads(environ.get("CCXT_CACHE_MAP", "{}"))
 }
 
 
+@register([QUOTE, BATCH], latency=1.5)
 class CCXT(AbstractProvider):
 	name = "CCXT"
 
 	@classmethod
-	def _request_quote(cls, request, ticker):
+	async def _request_quote_async(cls, request, ticker):
 		symbol = ticker.get("symbol")
 		exchange = ticker["exchange"]
 		if not exchange:
 			return None, None
 		esDocId = CCXT_TO_CACHE_MAP.get(exchange["id"])
 
-		if exchange["id"] in PROXY_BLACKLIST:
-			ccxtInstance = getattr(ccxt, exchange["id"])()
-		else:
-			ccxtInstance = getattr(ccxt, exchange["id"])({
-				"proxies": {
-					"http": f"http://{environ['PROXY_IP']}",
-					"https": f"http://{environ['PROXY_IP']}"
-				}
-			})
+		if esDocId is not None and not symbol.endswith((".FUNDING", ".OI", ".LS")):
+			try:
+				data = await cache_index.get_document(esDocId + ticker.get("id"))
+			except:
+				print(format_exc())
+				data = None
+			if data is not None:
+				return CCXT._parse_cache(ticker, exchange, data)
 
-		tf, limitTimestamp, candleOffset = CCXT.get_highest_supported_timeframe(ccxtInstance, datetime.now().astimezone(timezone.utc))
+		try:
+			ccxtInstance = await asyncExchangePool.acquire(exchange["id"])
+		except:
+			print(format_exc())
+			return None, f"Data from {exchange['name']} is currently unavailable."
 
 		if symbol.endswith(".FUNDING"):
 			try:
-				rawData = ccxtInstance.fetchFundingRate(symbol)
+				await get_limiter(CCXT.name, exchange["id"]).acquire()
+				rawData = await ccxtInstance.fetchFundingRate(symbol)
 			except NotSupported:
 				return None, f"Funding is not supported by {exchange['name']}. The requested ticker is likely a spot market."
 			except:
 				print(format_exc())
 				return None, None
-
-			fundingRate = rawData["fundingRate"]
-			predictedFundingRate = rawData.get("nextFundingRate")
-			if rawData["fundingTimestamp"] is not None:
-				fundingDate = datetime.fromtimestamp(rawData["fundingTimestamp"] / 1000).astimezone(timezone.utc)
-			elif rawData["fundingDatetime"] is not None:
-				fundingDate = datetime.strptime(rawData["fundingDatetime"], "%Y-%m-%dT%H:%M:00.000Z").replace(tzinfo=timezone.utc)
-			else:
-				fundingDate = None
-			averageFundingRate = fundingRate if predictedFundingRate is None else (fundingRate + predictedFundingRate) / 2
-			coinThumbnail = static_storage.icon if ticker.get("image") is None else ticker.get("image")
-
-			payload = {
-				"quotePrice": "Funding Rate: {:+.4f} %".format(fundingRate * 100),
-				"quoteConvertedPrice": None if predictedFundingRate is None else "Predicted Rate: {:+.4f} %".format(predictedFundingRate * 100),
-				"title": ticker.get("name"),
-				"change": None if fundingDate is None else f"<t:{int(datetime.timestamp(fundingDate))}:R>",
-				"thumbnailUrl": coinThumbnail,
-				"messageColor": "yellow" if averageFundingRate == 0.01 else ("light green" if averageFundingRate < 0.01 else "deep orange"),
-				"sourceText": f"Funding on {exchange['name']}",
-				"platform": CCXT.name,
-				"raw": {
-					"quotePrice": [fundingRate, predictedFundingRate],
-					"timestamp": time()
-				}
-			}
-			return payload, None
+			return CCXT._parse_funding(ticker, exchange, rawData)
 
 		elif symbol.endswith(".OI"):
 			try:
-				rawData = ccxtInstance.fetchOpenInterestHistory(symbol, limit=1)
+				await get_limiter(CCXT.name, exchange["id"]).acquire()
+				rawData = await ccxtInstance.fetchOpenInterestHistory(symbol, limit=1)
 			except (NotSupported, BadSymbol):
 				return None, f"Funding is not supported by {exchange['name']}. The requested ticker is likely a spot market."
 			except:
 				print(format_exc())
 				return None, None
-
-			openInterest = rawData[0]["openInterestAmount"]
-			openValue = rawData[0]["openInterestValue"]
-			coinThumbnail = static_storage.icon if ticker.get("image") is None else ticker.get("image")
-
-			payload = {
-				"quotePrice": "Open interest: {:,.0f} contracts".format(openInterest),
-				"quoteConvertedPrice": "Open value: {:,.4f}".format(openValue),
-				"title": ticker.get("name"),
-				"thumbnailUrl": coinThumbnail,
-				"messageColor": "deep purple",
-				"sourceText": f"Open interest on {exchange['name']}",
-				"platform": CCXT.name,
-				"raw": {
-					"quotePrice": [openInterest, openValue],
-					"timestamp": time()
-				}
-			}
-			return payload, None
+			return CCXT._parse_open_interest(ticker, exchange, rawData)
 
 		elif symbol.endswith(".LS"):
 			if exchange["id"] == "bitfinex2":
 				try:
-					longs = ccxtInstance.publicGetStats1KeySizeSymbolLongLast({"key": "pos.size", "size": "1m", "symbol": f"t{ticker.get('id')}", "side": "long", "section": "last"})
-					shorts = ccxtInstance.publicGetStats1KeySizeSymbolShortLast({"key": "pos.size", "size": "1m", "symbol": f"t{ticker.get('id')}", "side": "long", "section": "last"})
-					ratio = longs[1] / (longs[1] + shorts[1]) * 100
+					await get_limiter(CCXT.name, exchange["id"]).acquire(2)
+					longs = await ccxtInstance.publicGetStats1KeySizeSymbolLongLast({"key": "pos.size", "size": "1m", "symbol": f"t{ticker.get('id')}", "side": "long", "section": "last"})
+					shorts = await ccxtInstance.publicGetStats1KeySizeSymbolShortLast({"key": "pos.size", "size": "1m", "symbol": f"t{ticker.get('id')}", "side": "long", "section": "last"})
 				except:
 					return None, None
-
-				coinThumbnail = static_storage.icon if ticker.get("image") is None else ticker.get("image")
-
-				payload = {
-					"quotePrice": "{:.1f} % longs / {:.1f} % shorts".format(ratio, 100 - ratio),
-					"title": ticker.get("name"),
-					"change": f"in {deltaFundingText}",
-					"thumbnailUrl": coinThumbnail,
-					"messageColor": "deep purple",
-					"sourceText": f"Longs/shorts on {exchange['name']}",
-					"platform": CCXT.name,
-					"raw": {
-						"quotePrice": [longs[1], shorts[1]],
-						"timestamp": time()
-					}
-				}
-				return payload, None
+				return CCXT._parse_longs_shorts(ticker, exchange, longs, shorts)
 			return None, "Longs and shorts data is only available on Bitfinex."
 
-		elif esDocId is not None:
-			# Get document by id
-			response = elasticsearch.search(index="cache", body={"query": {"match": {"_id": esDocId + ticker.get("id")}}})
-			if len(response["hits"]["hits"]) == 0:
-				return None, None
+		else:
+			tf, limitTimestamp, candleOffset = CCXT.get_highest_supported_timeframe(ccxtInstance, datetime.now().astimezone(timezone.utc))
+			candles = candleStore.get(exchange["id"], symbol, tf)
+			try:
+				await get_limiter(CCXT.name, exchange["id"]).acquire()
+				rawData = await ccxtInstance.fetch_ohlcv(symbol, timeframe=tf, since=CCXT.get_fetch_since(candles, limitTimestamp), limit=150)
+				candles.merge(rawData)
+			except:
+				print(format_exc())
+				return None, f"Data from {exchange['name']} is currently unavailable."
+			return CCXT._parse_ohlcv(ticker, exchange, ccxtInstance, candles, tf, candleOffset)
+
+	@staticmethod
+	def _parse_funding(ticker, exchange, rawData):
+		fundingRate = rawData["fundingRate"]
+		predictedFundingRate = rawData.get("nextFundingRate")
+		if rawData["fundingTimestamp"] is not None:
+			fundingDate = datetime.fromtimestamp(rawData["fundingTimestamp"] / 1000).astimezone(timezone.utc)
+		elif rawData["fundingDatetime"] is not None:
+			fundingDate = datetime.strptime(rawData["fundingDatetime"], "%Y-%m-%dT%H:%M:00.000Z").replace(tzinfo=timezone.utc)
+		else:
+			fundingDate = None
+		averageFundingRate = fundingRate if predictedFundingRate is None else (fundingRate + predictedFundingRate) / 2
+		coinThumbnail = static_storage.icon if ticker.get("image") is None else ticker.get("image")
 
-			data = response["hits"]["hits"][0]["_source"]
-
-			priceChange = (data["close"] / data["open"]) * 100 - 100
-			coinThumbnail = static_storage.icon if ticker.get("image") is None else ticker.get("image")
-
-			payload = {
-				"quotePrice": "{:,.10f}".format(data["close"]).rstrip('0').rstrip('.') + " " + ticker.get("quote"),
-				"quoteVolume": "{:,.4f}".format(data["volume"]).rstrip('0').rstrip('.') + " " + ticker.get("base"),
-				"title": ticker.get("name"),
-				"change": "{:+.2f} %".format(priceChange),
-				"thumbnailUrl": coinThumbnail,
-				"messageColor": "amber" if priceChange == 0 else ("green" if priceChange > 0 else "red"),
-				"sourceText": f"{ticker['id']} data from {exchange['name']}",
-				"platform": CCXT.name,
-				"raw": {
-					"quotePrice": [data["open"], data["close"]],
-					"quoteVolume": [data["volume"]],
-					"timestamp": time()
-				}
+		payload = {
+			"quotePrice": "Funding Rate: {:+.4f} %".format(fundingRate * 100),
+			"quoteConvertedPrice": None if predictedFundingRate is None else "Predicted Rate: {:+.4f} %".format(predictedFundingRate * 100),
+			"title": ticker.get("name"),
+			"change": None if fundingDate is None else f"<t:{int(datetime.timestamp(fundingDate))}:R>",
+			"thumbnailUrl": coinThumbnail,
+			"messageColor": "yellow" if averageFundingRate == 0.01 else ("light green" if averageFundingRate < 0.01 else "deep orange"),
+			"sourceText": f"Funding on {exchange['name']}",
+			"platform": CCXT.name,
+			"raw": {
+				"quotePrice": [fundingRate, predictedFundingRate],
+				"timestamp": time()
 			}
+		}
+		return payload, None
+
+	@staticmethod
+	def _parse_open_interest(ticker, exchange, rawData):
+		openInterest = rawData[0]["openInterestAmount"]
+		openValue = rawData[0]["openInterestValue"]
+		coinThumbnail = static_storage.icon if ticker.get("image") is None else ticker.get("image")
 
-			return payload, None
+		payload = {
+			"quotePrice": "Open interest: {:,.0f} contracts".format(openInterest),
+			"quoteConvertedPrice": "Open value: {:,.4f}".format(openValue),
+			"title": ticker.get("name"),
+			"thumbnailUrl": coinThumbnail,
+			"messageColor": "deep purple",
+			"sourceText": f"Open interest on {exchange['name']}",
+			"platform": CCXT.name,
+			"raw": {
+				"quotePrice": [openInterest, openValue],
+				"timestamp": time()
+			}
+		}
+		return payload, None
 
-		else:
+	@staticmethod
+	def _parse_longs_shorts(ticker, exchange, longs, shorts):
+		try:
+			ratio = longs[1] / (longs[1] + shorts[1]) * 100
+		except:
+			return None, None
+
+		coinThumbnail = static_storage.icon if ticker.get("image") is None else ticker.get("image")
+
+		payload = {
+			"quotePrice": "{:.1f} % longs / {:.1f} % shorts".format(ratio, 100 - ratio),
+			"title": ticker.get("name"),
+			"thumbnailUrl": coinThumbnail,
+			"messageColor": "deep purple",
+			"sourceText": f"Longs/shorts on {exchange['name']}",
+			"platform": CCXT.name,
+			"raw": {
+				"quotePrice": [longs[1], shorts[1]],
+				"timestamp": time()
+			}
+		}
+		return payload, None
+
+	@classmethod
+	async def _request_quote_batch_async(cls, items):
+		results = [None] * len(items)
+		cacheLookups = {}
+		for i, (request, ticker) in enumerate(items):
+			symbol = ticker.get("symbol")
+			exchange = ticker["exchange"]
+			if exchange and exchange["id"] in CCXT_TO_CACHE_MAP and not symbol.endswith((".FUNDING", ".OI", ".LS")):
+				cacheLookups[i] = CCXT_TO_CACHE_MAP[exchange["id"]] + ticker.get("id")
+
+		if len(cacheLookups) != 0:
 			try:
-				rawData = ccxtInstance.fetch_ohlcv(symbol, timeframe=tf, since=limitTimestamp, limit=150)
-				if len(rawData) == 0 or rawData[-1][4] is None or rawData[0][1] is None: return None, None
+				documents = await cache_index.get_documents(list(cacheLookups.values()))
 			except:
 				print(format_exc())
-				return None, f"Data from {exchange['name']} is currently unavailable."
+				documents = {}
+			for i, docId in cacheLookups.items():
+				request, ticker = items[i]
+				if docId in documents:
+					results[i] = CCXT._parse_cache(ticker, ticker["exchange"], documents[docId])
+
+		# Exchange tickers are built from candles exactly like single quotes, since both share the quote cache.
+		# Bulk ticker endpoints report a rolling 24h change instead of the daily open, so they are not used here.
+		remaining = [i for i, result in enumerate(results) if result is None]
+		for i, result in zip(remaining, await gather_quotes([CCXT._request_quote_limited(*items[i]) for i in remaining])):
+			results[i] = result
+		return results
+
+	@staticmethod
+	def _parse_ticker(ticker, exchange, data):
+		price = data["last"]
+		volume = data.get("baseVolume") or 0
+		priceChange = data.get("percentage") or 0
+		coinThumbnail = static_storage.icon if ticker.get("image") is None else ticker.get("image")
 
-			price = [rawData[-1][4], rawData[0][1]] if len(rawData) < candleOffset else [rawData[-1][4], rawData[-candleOffset][1]]
-			volume = None if price[0] is None else sum([candle[5] for candle in rawData if int(candle[0] / 1000) >= int(ccxtInstance.milliseconds() / 1000) - 86400]) / (price[0] if exchange["id"] == "bitmex" else 1)
-			priceChange = 0 if tf == "1m" or price[1] == 0 else (price[0] / price[1]) * 100 - 100
-			coinThumbnail = static_storage.icon if ticker.get("image") is None else ticker.get("image")
-
-			payload = {
-				"quotePrice": "{:,.10f}".format(price[0]).rstrip('0').rstrip('.') + " " + ticker.get("quote"),
-				"quoteVolume": "{:,.4f}".format(volume).rstrip('0').rstrip('.') + " " + ticker.get("base"),
-				"title": ticker.get("name"),
-				"change": "{:+.2f} %".format(priceChange),
-				"thumbnailUrl": coinThumbnail,
-				"messageColor": "amber" if priceChange == 0 else ("green" if priceChange > 0 else "red"),
-				"sourceText": f"{ticker['id']} data from {exchange['name']}",
-				"platform": CCXT.name,
-				"raw": {
-					"quotePrice": [price[0]] if tf == "1m" else price[:1],
-					"quoteVolume": [volume],
-					"timestamp": time()
-				}
+		payload = {
+			"quotePrice": "{:,.10f}".format(price).rstrip('0').rstrip('.') + " " + ticker.get("quote"),
+			"quoteVolume": "{:,.4f}".format(volume).rstrip('0').rstrip('.') + " " + ticker.get("base"),
+			"title": ticker.get("name"),
+			"change": "{:+.2f} %".format(priceChange),
+			"thumbnailUrl": coinThumbnail,
+			"messageColor": "amber" if priceChange == 0 else ("green" if priceChange > 0 else "red"),
+			"sourceText": f"{ticker['id']} data from {exchange['name']}",
+			"platform": CCXT.name,
+			"raw": {
+				"quotePrice": [price],
+				"quoteVolume": [volume],
+				"timestamp": time()
 			}
+		}
 
-			return payload, None
+		return payload, None
+
+	@staticmethod
+	def _parse_cache(ticker, exchange, data):
+		priceChange = (data["close"] / data["open"]) * 100 - 100
+		coinThumbnail = static_storage.icon if ticker.get("image") is None else ticker.get("image")
+
+		payload = {
+			"quotePrice": "{:,.10f}".format(data["close"]).rstrip('0').rstrip('.') + " " + ticker.get("quote"),
+			"quoteVolume": "{:,.4f}".format(data["volume"]).rstrip('0').rstrip('.') + " " + ticker.get("base"),
+			"title": ticker.get("name"),
+			"change": "{:+.2f} %".format(priceChange),
+			"thumbnailUrl": coinThumbnail,
+			"messageColor": "amber" if priceChange == 0 else ("green" if priceChange > 0 else "red"),
+			"sourceText": f"{ticker['id']} data from {exchange['name']}",
+			"platform": CCXT.name,
+			"raw": {
+				"quotePrice": [data["open"], data["close"]],
+				"quoteVolume": [data["volume"]],
+				"timestamp": time()
+			}
+		}
+
+		return payload, None
+
+	@staticmethod
+	def _parse_ohlcv(ticker, exchange, ccxtInstance, candles, tf, candleOffset):
+		summary = candles.summary((int(ccxtInstance.milliseconds() / 1000) - 86400) * 1000, candleOffset)
+		if summary is None: return None, None
+		close, periodOpen, volume = summary
+		price = [close, periodOpen]
+		volume = volume / (price[0] if exchange["id"] == "bitmex" else 1)
+		priceChange = 0 if tf == "1m" or price[1] == 0 else (price[0] / price[1]) * 100 - 100
+		coinThumbnail = static_storage.icon if ticker.get("image") is None else ticker.get("image")
+
+		payload = {
+			"quotePrice": "{:,.10f}".format(price[0]).rstrip('0').rstrip('.') + " " + ticker.get("quote"),
+			"quoteVolume": "{:,.4f}".format(volume).rstrip('0').rstrip('.') + " " + ticker.get("base"),
+			"title": ticker.get("name"),
+			"change": "{:+.2f} %".format(priceChange),
+			"thumbnailUrl": coinThumbnail,
+			"messageColor": "amber" if priceChange == 0 else ("green" if priceChange > 0 else "red"),
+			"sourceText": f"{ticker['id']} data from {exchange['name']}",
+			"platform": CCXT.name,
+			"raw": {
+				"quotePrice": [price[0]] if tf == "1m" else price[:1],
+				"quoteVolume": [volume],
+				"timestamp": time()
+			}
+		}
+
+		return payload, None
+
+	@staticmethod
+	def get_fetch_since(candles, limitTimestamp):
+		# Once a market is buffered, only the forming candle and anything newer is requested
+		lastTimestamp = candles.last_timestamp()
+		if lastTimestamp is not None and lastTimestamp >= limitTimestamp: return lastTimestamp
+		# A buffer that stopped before the quoted window would be left with a gap, so it is refilled from scratch
+		candles.clear()
+		return limitTimestamp
 
 	@staticmethod
 	def get_highest_supported_timeframe(exchange, n):
-		if exchange.timeframes is None: return ("1m", int(exchange.milliseconds() / 1000) - 60, 2)
+		if exchange.timeframes is None: return ("1m", (int(exchange.milliseconds() / 1000) - 60) * 1000, 2)
 		dailyOpen = (int(exchange.milliseconds() / 1000) - (n.second + n.minute * 60 + n.hour * 3600)) * 1000
 		rolling24h = (int(exchange.milliseconds() / 1000) - 86400) * 1000
 		availableTimeframes = ["10m", "15m", "20m", "30m", "1h", "2h", "3h", "4h", "6h", "8h", "12h", "1d"]
 		for tf in availableTimeframes:
 			if tf in exchange.timeframes:
 				return tf, rolling24h, ceil(int((exchange.milliseconds() - dailyOpen) / 1000) / CCXT.get_frequency_time(tf))
-		return ("1m", int(exchange.milliseconds() / 1000) - 60, 2)
+		return ("1m", (int(exchange.milliseconds() / 1000) - 60) * 1000, 2)
 
 	@staticmethod
 	def get_frequency_time(t):
@@ -1,29 +1,46 @@
 from os import environ
 from time import time
 from traceback import format_exc
-import requests
 from orjson import loads
 
 from components.abstract import AbstractProvider
+from helpers.providers import register, QUOTE
+from helpers.ratelimits import get_limiter, fingerprint
+from helpers import http
 from assets import static_storage
 
 
+COINGECKO_API_URL = environ.get("COINGECKO_API_URL", "https://pro-api.coingecko.com/api/v3")
+
+
+@register([QUOTE], latency=1.5)
 class Chain(AbstractProvider):
 	name = "On-Chain"
+	# The on-chain endpoints are billed against the same CoinGecko API key
+	limiter = get_limiter("CoinGecko", fingerprint(environ["COINGECKO_API_KEY"]))
 
 	@classmethod
-	def _request_quote(cls, request, ticker):
-		symbol = ticker.get("id")
-		exchange = ticker["exchange"]
-
+	async def _request_quote_async(cls, request, ticker):
 		try:
-			url = f"https://pro-api.coingecko.com/api/v3/onchain/networks/{exchange.get('id', 'eth')}/pools/{symbol}"
-			response = requests.get(url, headers={"accept": "application/json", "x-cg-pro-api-key": environ["COINGECKO_API_KEY"]})
-			rawData = loads(response.text)["data"]["attributes"]
+			await Chain.limiter.acquire()
+			response = await http.get(Chain._pool_url(ticker), headers=Chain._headers())
+			rawData = loads(response.content)["data"]["attributes"]
 		except:
 			print(format_exc())
 			return None, None
 
+		return Chain._parse_quote(ticker, rawData)
+
+	@staticmethod
+	def _pool_url(ticker):
+		return f"{COINGECKO_API_URL}/onchain/networks/{ticker['exchange'].get('id', 'eth')}/pools/{ticker.get('id')}"
+
+	@staticmethod
+	def _headers():
+		return {"accept": "application/json", "x-cg-pro-api-key": environ["COINGECKO_API_KEY"]}
+
+	@staticmethod
+	def _parse_quote(ticker, rawData):
 		price = rawData["base_token_price_usd"][:10]
 		rawPrice = rawData["base_token_price_native_currency"][:14]
 		volume = rawData["volume_usd"]["h24"]
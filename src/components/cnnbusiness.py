@@ -1,24 +1,47 @@
+from os import environ
 from time import time
-from requests import get
+from traceback import format_exc
 
 from components.abstract import AbstractProvider
+from helpers.providers import register, QUOTE
+from helpers.snapshots import snapshots
+from helpers import http
 from assets import static_storage
 
 
+FEAR_GREED_URL = environ.get("CNN_API_URL", "https://production.dataviz.cnn.io") + "/index/fearandgreed/graphdata"
+HEADERS = {
+	"Accept": "application/json",
+	"Origin": "https://edition.cnn.com",
+	"Accept-Encoding": "gzip, deflate, br",
+	"Host": "production.dataviz.cnn.io",
+	"User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/16.0 Safari/605.1.15",
+	"Accept-Language": "en-GB,en-US;q=0.9,en;q=0.8",
+	"Referer": "https://edition.cnn.com/",
+}
+
+
+@register([QUOTE])
 class CNNBusiness(AbstractProvider):
 	name = "CNN Business"
 
 	@classmethod
-	def _request_quote(cls, request, ticker):
-		r = get("https://production.dataviz.cnn.io/index/fearandgreed/graphdata", headers={
-			"Accept": "application/json",
-			"Origin": "https://edition.cnn.com",
-			"Accept-Encoding": "gzip, deflate, br",
-			"Host": "production.dataviz.cnn.io",
-			"User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/16.0 Safari/605.1.15",
-			"Accept-Language": "en-GB,en-US;q=0.9,en;q=0.8",
-			"Referer": "https://edition.cnn.com/",
-		}).json()
+	async def _request_quote_async(cls, request, ticker):
+		try:
+			r = await snapshots.get(CNNBusiness.name)
+		except:
+			print(format_exc())
+			return None, None
+		return CNNBusiness._parse_quote(r)
+
+	@staticmethod
+	async def _fetch_index():
+		response = await http.get(FEAR_GREED_URL, headers=HEADERS)
+		response.raise_for_status()
+		return response.json()
+
+	@staticmethod
+	def _parse_quote(r):
 		fearGreedIndex = int(round(r["fear_and_greed"]["score"]))
 
 		payload = {
@@ -35,4 +58,7 @@ class CNNBusiness(AbstractProvider):
 				"timestamp": time()
 			}
 		}
-		return payload, None
\ No newline at end of file
+		return payload, None
+
+
+snapshots.register(CNNBusiness.name, CNNBusiness._fetch_index, interval=300)
@@ -1,121 +1,222 @@
 from os import environ
 from time import time
+from asyncio import gather
+from functools import partial
+from hashlib import sha1
 from traceback import format_exc
 
-from pycoingecko import CoinGeckoAPI
+from orjson import loads
 from markdownify import markdownify
 
-from components.abstract import AbstractProvider
+from components.abstract import AbstractProvider, gather_quotes
+from helpers.providers import register, QUOTE, DETAIL, BATCH
+from helpers.cache import PersistentCache, DetailCache
+from helpers.ratelimits import get_limiter, fingerprint
+from helpers.snapshots import snapshots
+from helpers.executors import run_in_executor
+from helpers.numeric import to_array, highest, lowest, HIGH, LOW
+from helpers import http, metrics
 from assets import static_storage
 
 
+COINGECKO_API_URL = environ.get("COINGECKO_API_URL", "https://pro-api.coingecko.com/api/v3")
+GLOBAL_SNAPSHOT = "CoinGecko global"
+# Coin profiles rarely change, while market data and the yearly range back live figures
+PROFILE_TTL = 3 * 86400
+MARKET_TTL = 120
+SERIES_TTL = 1800
+DESCRIPTION_TTL = 30 * 86400
+
+profiles = DetailCache("coingecko_profiles", "CoinGecko", PROFILE_TTL, maxSize=10000, path=environ.get("METADATA_CACHE_PATH"))
+markets = DetailCache("coingecko_markets", "CoinGecko", MARKET_TTL, maxSize=10000)
+series = DetailCache("coingecko_series", "CoinGecko", SERIES_TTL, maxSize=10000)
+descriptions = PersistentCache("coingecko_descriptions", maxSize=10000, path=environ.get("METADATA_CACHE_PATH"))
+
+
+@register([QUOTE, DETAIL, BATCH])
 class CoinGecko(AbstractProvider):
 	name = "CoinGecko"
-	connection = CoinGeckoAPI(api_key=environ["COINGECKO_API_KEY"])
+	limiter = get_limiter("CoinGecko", fingerprint(environ["COINGECKO_API_KEY"]))
 
 	@classmethod
-	def _request_quote(cls, request, ticker):
+	async def _request_quote_async(cls, request, ticker):
 		symbol = ticker.get("symbol")
 
 		if symbol.endswith(".D"):
-			try: rawData = CoinGecko.connection.get_global()
+			# Every dominance ticker reads the same global dataset, so it is kept as one background refreshed snapshot
+			try: rawData = await snapshots.get(GLOBAL_SNAPSHOT)
 			except: return None, f"Requested dominance data for `{ticker.get('name')}` is not available."
-			if ticker.get("base").lower() not in rawData["market_cap_percentage"]: return None, f"Dominance for {ticker.get('base')} does not exist."
-			coinDominance = rawData["market_cap_percentage"][ticker.get("base").lower()]
-
-			coinThumbnail = static_storage.icon if ticker.get("image") is None else ticker.get("image")
-
-			payload = {
-				"quotePrice": "{:,.2f} %".format(coinDominance),
-				"title": f"{ticker.get('name')} market dominance",
-				"thumbnailUrl": coinThumbnail,
-				"messageColor": "deep purple",
-				"sourceText": "Market information from CoinGecko",
-				"platform": CoinGecko.name,
-				"raw": {
-					"quotePrice": [coinDominance],
-					"timestamp": time()
-				}
-			}
-			return payload, None
+			return CoinGecko._parse_dominance(ticker, rawData)
 
 		else:
+			# Quotes only need three numbers, so the lean price endpoint is used and the full coin document is left to details
 			try:
-				rawData = CoinGecko.connection.get_coin_by_id(id=symbol, localization="false", tickers=False, market_data=True, community_data=False, developer_data=False)
+				rawData = await CoinGecko._get("/simple/price", params=CoinGecko._simple_price_params([symbol], [ticker.get("quote").lower()]))
 			except:
 				print(format_exc())
 				return None, None
+			if symbol not in rawData: return None, None
+			return CoinGecko._parse_simple_price(ticker, rawData[symbol])
+
+	@staticmethod
+	async def _get(path, params=None):
+		await CoinGecko.limiter.acquire()
+		response = await http.get(COINGECKO_API_URL + path, params=params, headers={"accept": "application/json", "x-cg-pro-api-key": environ["COINGECKO_API_KEY"]})
+		response.raise_for_status()
+		return loads(response.content)
+
+	@staticmethod
+	def _simple_price_params(ids, currencies):
+		return {"ids": ",".join(ids), "vs_currencies": ",".join(sorted(set(currencies) | {"usd"})), "include_24hr_vol": "true", "include_24hr_change": "true"}
+
+	@staticmethod
+	def _render_description(descriptionHtml):
+		description = markdownify(descriptionHtml)
+		descriptionParagraphs = description.split("\r\n\r\n")
+		textLength = [len(descriptionParagraphs[0])]
+		for i in range(1, len(descriptionParagraphs)):
+			nextLength = textLength[-1] + len(descriptionParagraphs[i])
+			if nextLength > 500 and textLength[-1] > 300 or nextLength > 1900: break
+			textLength.append(nextLength)
+		return "\n".join(descriptionParagraphs[:len(textLength)])
+
+	@staticmethod
+	async def _request_profile(symbol):
+		rawData = await CoinGecko._get(f"/coins/{symbol}", params={"localization": "false", "tickers": "false", "market_data": "false", "community_data": "false", "developer_data": "false"})
+		# Only the fields shown in details are kept, since profiles are persisted for days
+		return {"name": rawData["name"], "description": rawData["description"], "image": rawData["image"], "links": {"homepage": rawData["links"]["homepage"]}}
+
+	@staticmethod
+	async def _request_market(symbol):
+		rawData = await CoinGecko._get("/coins/markets", params={"vs_currency": "usd", "ids": symbol, "price_change_percentage": "24h,30d,1y"})
+		if len(rawData) == 0: raise ValueError(f"No market data for {symbol}")
+		return rawData[0]
+
+	@staticmethod
+	async def _fetch_global():
+		return (await CoinGecko._get("/global"))["data"]
+
+	@staticmethod
+	def _parse_dominance(ticker, rawData):
+		if ticker.get("base").lower() not in rawData["market_cap_percentage"]: return None, f"Dominance for {ticker.get('base')} does not exist."
+		coinDominance = rawData["market_cap_percentage"][ticker.get("base").lower()]
+
+		coinThumbnail = static_storage.icon if ticker.get("image") is None else ticker.get("image")
+
+		payload = {
+			"quotePrice": "{:,.2f} %".format(coinDominance),
+			"title": f"{ticker.get('name')} market dominance",
+			"thumbnailUrl": coinThumbnail,
+			"messageColor": "deep purple",
+			"sourceText": "Market information from CoinGecko",
+			"platform": CoinGecko.name,
+			"raw": {
+				"quotePrice": [coinDominance],
+				"timestamp": time()
+			}
+		}
+		return payload, None
+
+	@classmethod
+	async def _request_quote_batch_async(cls, items):
+		results = [None] * len(items)
+		priceLookups = [i for i, (request, ticker) in enumerate(items) if not ticker.get("symbol").endswith(".D")]
 
-			coinThumbnail = static_storage.icon if ticker.get("image") is None else ticker.get("image")
-
-			if ticker.get("quote").lower() not in rawData["market_data"]["current_price"] or ticker.get("quote").lower() not in rawData["market_data"]["total_volume"]: return None, None
-
-			price = rawData["market_data"]["current_price"][ticker.get("quote").lower()]
-			volume = rawData["market_data"]["total_volume"][ticker.get("quote").lower()]
-			priceChange = rawData["market_data"]["price_change_percentage_24h_in_currency"][ticker.get("quote").lower()] if ticker.get("quote").lower() in rawData["market_data"]["price_change_percentage_24h_in_currency"] else 0
-
-			priceText = "{:,.8g}".format(price)
-			if price < 1 and "e-" in priceText:
-				number, exponent = priceText.split("e-", 1)
-				priceText = ("{:,.%df}" % (len(number) + int(exponent))).format(price).rstrip('0')
-
-			payload = {
-				"quotePrice": priceText + " " + ticker.get("quote"),
-				"quoteVolume": "{:,.4f}".format(volume).rstrip('0').rstrip('.') + " " + ticker.get("base"),
-				"title": ticker.get("name"),
-				"change": "{:+.2f} %".format(priceChange),
-				"thumbnailUrl": coinThumbnail,
-				"messageColor": "amber" if priceChange == 0 else ("green" if priceChange > 0 else "red"),
-				"sourceText": f"{ticker['id']} data from CoinGecko",
-				"platform": CoinGecko.name,
-				"raw": {
-					"quotePrice": [price],
-					"quoteVolume": [volume],
-					"timestamp": time()
-				}
+		if len(priceLookups) > 1:
+			ids = sorted(set(items[i][1].get("symbol") for i in priceLookups))
+			currencies = [items[i][1].get("quote").lower() for i in priceLookups]
+			try:
+				rawData = await CoinGecko._get("/simple/price", params=CoinGecko._simple_price_params(ids, currencies))
+				for i in priceLookups:
+					request, ticker = items[i]
+					results[i] = CoinGecko._parse_simple_price(ticker, rawData[ticker.get("symbol")]) if ticker.get("symbol") in rawData else (None, None)
+			except:
+				print(format_exc())
+
+		remaining = [i for i, result in enumerate(results) if result is None]
+		for i, result in zip(remaining, await gather_quotes([CoinGecko._request_quote_limited(*items[i]) for i in remaining])):
+			results[i] = result
+		return results
+
+	@staticmethod
+	def _parse_simple_price(ticker, rawData):
+		quote = ticker.get("quote").lower()
+		if rawData.get(quote) is None or rawData.get(f"{quote}_24h_vol") is None: return None, None
+
+		return CoinGecko._format_price(ticker, rawData[quote], rawData[f"{quote}_24h_vol"], rawData.get(f"{quote}_24h_change") or 0, rawData.get("usd"), rawData.get("usd_24h_vol"))
+
+	@staticmethod
+	def _format_price(ticker, price, volume, priceChange, usdPrice, usdVolume):
+		coinThumbnail = static_storage.icon if ticker.get("image") is None else ticker.get("image")
+
+		priceText = "{:,.8g}".format(price)
+		if price < 1 and "e-" in priceText:
+			number, exponent = priceText.split("e-", 1)
+			priceText = ("{:,.%df}" % (len(number) + int(exponent))).format(price).rstrip('0')
+
+		payload = {
+			"quotePrice": priceText + " " + ticker.get("quote"),
+			"quoteVolume": "{:,.4f}".format(volume).rstrip('0').rstrip('.') + " " + ticker.get("base"),
+			"title": ticker.get("name"),
+			"change": "{:+.2f} %".format(priceChange),
+			"thumbnailUrl": coinThumbnail,
+			"messageColor": "amber" if priceChange == 0 else ("green" if priceChange > 0 else "red"),
+			"sourceText": f"{ticker['id']} data from CoinGecko",
+			"platform": CoinGecko.name,
+			"raw": {
+				"quotePrice": [price],
+				"quoteVolume": [volume],
+				"timestamp": time()
 			}
-			if ticker.get("quote") != "USD":
-				payload["quoteConvertedPrice"] = "≈ ${:,.6f}".format(rawData["market_data"]["current_price"]["usd"])
-				payload["quoteConvertedVolume"] = "≈ ${:,.4f}".format(rawData["market_data"]["total_volume"]["usd"])
+		}
+		if ticker.get("quote") != "USD":
+			payload["quoteConvertedPrice"] = "≈ ${:,.6f}".format(usdPrice)
+			payload["quoteConvertedVolume"] = "≈ ${:,.4f}".format(usdVolume)
 
-			return payload, None
+		return payload, None
 
 	@classmethod
-	def request_details(cls, request):
+	async def request_details(cls, request):
 		ticker = request.get("ticker")
+		symbol = ticker.get("symbol")
 
+		# The profile, market data and yearly range are cached on their own schedules and fetched concurrently
 		try:
-			assetData = CoinGecko.connection.get_coin_by_id(id=ticker.get("symbol"), localization="false", tickers=False, market_data=True, community_data=True, developer_data=True)
-			historicData = CoinGecko.connection.get_coin_ohlc_by_id(id=ticker.get("symbol"), vs_currency="usd", days=365)
+			assetData, marketData, historicData = await gather(
+				profiles.fetch(symbol, partial(CoinGecko._request_profile, symbol)),
+				markets.fetch(symbol, partial(CoinGecko._request_market, symbol)),
+				series.fetch(symbol, partial(CoinGecko._get, f"/coins/{symbol}/ohlc", params={"vs_currency": "usd", "days": "365"})),
+			)
 		except:
 			return None, None
 
-		description = markdownify(assetData["description"].get("en", "No description"))
-		descriptionParagraphs = description.split("\r\n\r\n")
-		textLength = [len(descriptionParagraphs[0])]
-		for i in range(1, len(descriptionParagraphs)):
-			nextLength = textLength[-1] + len(descriptionParagraphs[i])
-			if nextLength > 500 and textLength[-1] > 300 or nextLength > 1900: break
-			textLength.append(nextLength)
-		description = "\n".join(descriptionParagraphs[:len(textLength)])[:] + f"\n[Read more on CoinGecko](https://www.coingecko.com/coins/{ticker.get('symbol')})"
+		# Rendered descriptions are keyed by a hash of their HTML, so unchanged text is never parsed twice
+		descriptionHtml = assetData["description"].get("en", "No description")
+		key = sha1(descriptionHtml.encode()).hexdigest()
+		description = await descriptions.get_async(key)
+		metrics.cacheLookups.labels("descriptions", CoinGecko.name, "miss" if description is None else "hit").inc()
+		if description is None:
+			description = await run_in_executor(CoinGecko.name, CoinGecko._render_description, descriptionHtml)
+			descriptions.set(key, description, DESCRIPTION_TTL)
+		description += f"\n[Read more on CoinGecko](https://www.coingecko.com/coins/{ticker.get('symbol')})"
 
-		highs = [e[2] for e in historicData]
-		lows = [e[3] for e in historicData]
+		historicData = to_array(historicData, 5)
+		yearHigh, yearLow = highest(historicData[:, HIGH]), lowest(historicData[:, LOW])
 
 		payload = {
 			"name": f"{assetData['name']} ({ticker.get('base')})",
 			"description": description,
-			"rank": assetData["market_data"]["market_cap_rank"],
+			"rank": marketData.get("market_cap_rank"),
 			"supply": {},
 			"price": {
-				"current": assetData["market_data"]["current_price"].get("usd"),
-				"ath": assetData["market_data"]["ath"].get("usd"),
-				"atl": assetData["market_data"]["atl"].get("usd")
+				"current": marketData.get("current_price"),
+				"ath": marketData.get("ath"),
+				"atl": marketData.get("atl")
 			},
 			"change": {
-				"past day": assetData["market_data"]["price_change_percentage_24h_in_currency"].get("usd"),
-				"past month": assetData["market_data"]["price_change_percentage_30d_in_currency"].get("usd"),
-				"past year": assetData["market_data"]["price_change_percentage_1y_in_currency"].get("usd")
+				"past day": marketData.get("price_change_percentage_24h_in_currency"),
+				"past month": marketData.get("price_change_percentage_30d_in_currency"),
+				"past year": marketData.get("price_change_percentage_1y_in_currency")
 			},
 			"sourceText": "Data from CoinGecko",
 			"platform": "CoinGecko",
@@ -123,11 +224,14 @@ class CoinGecko(AbstractProvider):
 
 		if assetData["image"]["large"].startswith("http"): payload["image"] = assetData["image"]["large"]
 		if assetData["links"]["homepage"][0] != "": payload["url"] = assetData["links"]["homepage"][0].replace(" ", "") if assetData["links"]["homepage"][0].replace(" ", "").startswith("http") else "https://" + assetData["links"]["homepage"][0].replace(" ", "")
-		if assetData["market_data"]["total_volume"] is not None: payload["volume"] = assetData["market_data"]["total_volume"].get("usd")
-		if assetData["market_data"]["market_cap"] is not None: payload["marketcap"] = assetData["market_data"]["market_cap"].get("usd")
-		if assetData["market_data"]["total_supply"] is not None: payload["supply"]["total"] = assetData["market_data"]["total_supply"]
-		if assetData["market_data"]["circulating_supply"] is not None: payload["supply"]["circulating"] = assetData["market_data"]["circulating_supply"]
-		if len(highs) != 0: payload["price"]["1y high"] = max(highs)
-		if len(lows) != 0: payload["price"]["1y low"] = min(lows)
-
-		return payload, None
\ No newline at end of file
+		if marketData.get("total_volume") is not None: payload["volume"] = marketData["total_volume"]
+		if marketData.get("market_cap") is not None: payload["marketcap"] = marketData["market_cap"]
+		if marketData.get("total_supply") is not None: payload["supply"]["total"] = marketData["total_supply"]
+		if marketData.get("circulating_supply") is not None: payload["supply"]["circulating"] = marketData["circulating_supply"]
+		if yearHigh is not None: payload["price"]["1y high"] = yearHigh
+		if yearLow is not None: payload["price"]["1y low"] = yearLow
+
+		return payload, None
+
+
+snapshots.register(GLOBAL_SNAPSHOT, CoinGecko._fetch_global, interval=int(environ.get("COINGECKO_GLOBAL_INTERVAL", 60)))
\ No newline at end of file
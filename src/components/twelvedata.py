@@ -1,20 +1,58 @@
 from os import environ
 from time import time
-from io import BytesIO
-from base64 import decodebytes, b64encode
-from requests import get
+from asyncio import gather
+from functools import partial
+from threading import Lock
 from traceback import format_exc
 
-from PIL import Image
 from twelvedata import TDClient
 
-from components.abstract import AbstractProvider
+from components.abstract import AbstractProvider, gather_quotes
+from helpers.providers import register, QUOTE, DETAIL, BATCH
+from helpers.cache import PersistentCache, DetailCache
+from helpers.ratelimits import get_limiter, fingerprint, RateLimitExceeded
+from helpers.numeric import frame_columns, percent_change
+from helpers.executors import run_in_executor
+from helpers import metrics
 from assets import static_storage
 
 
-td = TDClient(apikey=environ["TWELVEDATA_KEY"])
+td = None
+tdLock = Lock()
+limiter = get_limiter("Twelvedata", fingerprint(environ["TWELVEDATA_KEY"]))
+logos = PersistentCache("logos", maxSize=50000, path=environ.get("METADATA_CACHE_PATH"))
 
+LOGO_TTL = 30 * 86400
+LOGO_MISS_TTL = 86400
+# Company profiles rarely change and statistics update daily, while the price series backs live figures
+PROFILE_TTL = 3 * 86400
+STATISTICS_TTL = 6 * 3600
+SERIES_TTL = 300
+# API credits consumed by each endpoint, per symbol
+CREDITS = {
+	"time_series": 1,
+	"exchange_rate": 1,
+	"logo": 1,
+	"profile": 10,
+	"statistics": 50,
+}
 
+profiles = DetailCache("profiles", "Twelvedata", PROFILE_TTL, maxSize=10000, path=environ.get("METADATA_CACHE_PATH"))
+statistics = DetailCache("statistics", "Twelvedata", STATISTICS_TTL, maxSize=10000, path=environ.get("METADATA_CACHE_PATH"))
+series = DetailCache("series", "Twelvedata", SERIES_TTL, maxSize=10000)
+
+
+def get_client():
+	# The client fetches endpoint metadata when constructed, so that round trip is deferred to the first request
+	global td
+	with tdLock:
+		if td is None:
+			td = TDClient(apikey=environ["TWELVEDATA_KEY"], base_url=environ.get("TWELVEDATA_API_URL"))
+			td.ctx.http_client.session.hooks["response"].append(metrics.on_requests_response)
+		return td
+
+
+@register([QUOTE, DETAIL, BATCH], latency=2.0)
 class Twelvedata(AbstractProvider):
 	name = "Twelvedata"
 
@@ -33,7 +71,8 @@ class Twelvedata(AbstractProvider):
 
 		try:
 			if ticker.get("quote") is None: return None, f"Price for `{ticker.get('name')}` is not available on {exchange['name']}."
-			rawData = td.time_series(
+			limiter.acquire_sync(CREDITS["time_series"])
+			rawData = get_client().time_series(
 				symbol=ticker.get("symbol"),
 				exchange=exchange.get("name"),
 				interval="1day",
@@ -45,21 +84,100 @@ class Twelvedata(AbstractProvider):
 			print(format_exc())
 			return None, None
 
+		if "volume" in rawData:
+			price, volume = frame_columns(rawData, ["close", "volume"]).T.tolist()
+		else:
+			price, volume = frame_columns(rawData, ["close"])[:, 0].tolist(), None
+		return Twelvedata._parse_stocks(ticker, exchange, price, volume, Twelvedata._request_logo(ticker, exchange))
+
+	@classmethod
+	async def _request_quote_batch_async(cls, items):
+		candles = await run_in_executor(Twelvedata.name, Twelvedata._request_quote_batch, items)
+		# Logos are looked up concurrently once the grouped call returns, instead of one by one inside it
+		found = [i for i, candle in enumerate(candles) if candle is not None]
+		lookups = {}
+		for i in found:
+			ticker = items[i][1]
+			lookups.setdefault(f"{ticker.get('symbol')}:{ticker['exchange'].get('name')}", ticker)
+		urls = await gather(*[run_in_executor(Twelvedata.name, Twelvedata._request_logo, ticker, ticker["exchange"]) for ticker in lookups.values()], return_exceptions=True)
+		urls = {key: None if isinstance(url, BaseException) else url for key, url in zip(lookups.keys(), urls)}
+
+		results = [None] * len(items)
+		for i in found:
+			ticker = items[i][1]
+			results[i] = Twelvedata._parse_stocks(ticker, ticker["exchange"], *candles[i], urls[f"{ticker.get('symbol')}:{ticker['exchange'].get('name')}"])
+		# Anything the grouped call missed is fetched on its own thread, so a failing batch does not turn serial
+		remaining = [i for i, result in enumerate(results) if result is None]
+		for i, result in zip(remaining, await gather_quotes([Twelvedata._request_quote_limited(*items[i]) for i in remaining])):
+			results[i] = result
+		return results
+
+	@classmethod
+	def _request_quote_batch(cls, items):
+		results = [None] * len(items)
+		stockLookups = {}
+		for i, (request, ticker) in enumerate(items):
+			exchange = ticker["exchange"]
+			if exchange and exchange.get("id") != "forex" and ticker.get("quote") is not None:
+				stockLookups.setdefault(f"{ticker.get('symbol')}:{exchange.get('name')}", []).append(i)
+
+		if len(stockLookups) > 1:
+			try:
+				limiter.acquire_sync(CREDITS["time_series"] * len(stockLookups))
+				rawData = get_client().time_series(
+					symbol=list(stockLookups.keys()),
+					interval="1day",
+					outputsize=2,
+					timezone="UTC",
+				).as_json()
+				rawData = {key.upper(): values for key, values in rawData.items()}
+			except:
+				print(format_exc())
+				rawData = {}
+			for key, indices in stockLookups.items():
+				values = rawData.get(key.upper())
+				if not values: continue
+				price = [float(candle["close"]) for candle in values]
+				volume = [float(candle["volume"]) for candle in values] if "volume" in values[0] else None
+				for i in indices:
+					results[i] = (price, volume)
+
+		return results
+
+	@staticmethod
+	def _request_logo(ticker, exchange):
+		hasExchange = exchange.get("id") is not None and exchange["id"] != "forex"
+		key = f"{ticker.get('symbol')}:{exchange.get('name') if hasExchange else ''}"
+		cached = logos.get(key)
+		metrics.cacheLookups.labels("logos", Twelvedata.name, "miss" if cached is None else "hit").inc()
+		if cached is not None: return cached or None
+
 		try:
-			if exchange.get("id") is not None and exchange["id"] != "forex":
-				stockLogoThumbnail = td.get_logo(
+			limiter.acquire_sync(CREDITS["logo"])
+			if hasExchange:
+				url = get_client().get_logo(
 					symbol=ticker.get("symbol"),
 					exchange=exchange.get("name"),
 				).as_json()["url"]
 			else:
-				stockLogoThumbnail = td.get_logo(
+				url = get_client().get_logo(
 					symbol=ticker.get("symbol")
 				).as_json()["url"]
+		except RateLimitExceeded:
+			return None
 		except:
-			stockLogoThumbnail = static_storage.icon
+			# Missing logos are remembered for a shorter while, since the lookup might have failed transiently
+			logos.set(key, "", LOGO_MISS_TTL)
+			return None
 
-		price = rawData["close"].tolist()
-		priceChange = ((price[0] / price[1] - 1) * 100) if len(price) > 1 and price[1] != 0 else 0
+		logos.set(key, url, LOGO_TTL)
+		return url
+
+	@staticmethod
+	def _parse_stocks(ticker, exchange, price, volume, logo):
+		stockLogoThumbnail = logo or static_storage.icon
+
+		priceChange = percent_change(price[0], price[1]) if len(price) > 1 else 0
 
 		priceText = "{:,.6f}".format(price[0]) if price[0] < 0.5 else "{:,.3f}".format(price[0])
 		payload = {
@@ -76,8 +194,7 @@ class Twelvedata(AbstractProvider):
 			}
 		}
 
-		if "volume" in rawData:
-			volume = rawData["volume"].tolist()
+		if volume is not None:
 			payload["quoteVolume"] = "{:,.4f}".format(volume[0]).rstrip('0').rstrip('.') + " " + ticker.get("base")
 			payload["raw"]["quoteVolume"] = volume
 
@@ -86,7 +203,8 @@ class Twelvedata(AbstractProvider):
 	@classmethod
 	def _request_forex(cls, request, ticker):
 		try:
-			rawData = td.exchange_rate(
+			limiter.acquire_sync(CREDITS["exchange_rate"])
+			rawData = get_client().exchange_rate(
 				symbol=ticker.get("symbol")
 			).as_json()
 			if rawData is None: return None, None
@@ -112,42 +230,26 @@ class Twelvedata(AbstractProvider):
 		return payload, None
 
 	@classmethod
-	def request_details(cls, request):
+	async def request_details(cls, request):
 		ticker = request.get("ticker")
 		exchange = ticker["exchange"]
 		if not exchange:
 			return None, None
 
+		# Each component is cached on its own schedule and the missing ones are fetched concurrently
+		key = f"{ticker.get('symbol')}:{exchange.get('name')}"
 		try:
-			companyData = td.get_profile(
-				symbol=ticker.get("symbol"),
-				exchange=ticker["exchange"].get("name"),
-			).as_json()
-			statsData = td.get_statistics(
-				symbol=ticker.get("symbol"),
-				exchange=exchange.get("name"),
-			).as_json()
-			rawData = td.time_series(
-				symbol=ticker.get("symbol"),
-				exchange=exchange.get("name"),
-				interval="1day",
-				outputsize=21,
-				timezone="UTC",
-			).as_pandas()
+			companyData, statsData, rawData, stockLogoThumbnail = await gather(
+				profiles.fetch(key, partial(Twelvedata._request_endpoint, "profile", "get_profile", symbol=ticker.get("symbol"), exchange=exchange.get("name"))),
+				statistics.fetch(key, partial(Twelvedata._request_statistics, ticker, exchange)),
+				series.fetch(key, partial(Twelvedata._request_series, ticker, exchange)),
+				run_in_executor(Twelvedata.name, Twelvedata._request_logo, ticker, exchange),
+			)
 		except:
 			print(format_exc())
 			return None, None
 
-		try:
-			stockLogoThumbnail = td.get_logo(
-				symbol=ticker.get("symbol"),
-				exchange=exchange.get("name"),
-			).as_json()["url"]
-		except:
-			stockLogoThumbnail = None
-
-		closePrice = rawData["close"].tolist()
-		openPrice = rawData["open"].tolist()
+		closePrice, openPrice = rawData
 
 		payload = {
 			"name": f"{companyData['name']} ({companyData['symbol']})",
@@ -159,32 +261,32 @@ class Twelvedata(AbstractProvider):
 				"location": f"{companyData['address']}, {companyData['city']}, {companyData['state']}, {companyData['country']}"
 			},
 			"price": {
-				"current": closePrice[0],
-				"52w high": statsData["statistics"]["stock_price_summary"]["fifty_two_week_high"],
-				"52w low": statsData["statistics"]["stock_price_summary"]["fifty_two_week_low"],
-				"beta": statsData["statistics"]["stock_price_summary"]["beta"]
+				"current": float(closePrice[0]),
+				"52w high": statsData["stock_price_summary"]["fifty_two_week_high"],
+				"52w low": statsData["stock_price_summary"]["fifty_two_week_low"],
+				"beta": statsData["stock_price_summary"]["beta"]
 			},
 			"valuation": {
-				"enterprise value": statsData["statistics"]["valuations_metrics"]["enterprise_value"],
-				"trailing PE": statsData["statistics"]["valuations_metrics"]["trailing_pe"],
-				"forward PE": statsData["statistics"]["valuations_metrics"]["forward_pe"],
-				"PEG": statsData["statistics"]["valuations_metrics"]["peg_ratio"],
-				"P/S": statsData["statistics"]["valuations_metrics"]["price_to_sales_ttm"],
-				"P/B": statsData["statistics"]["valuations_metrics"]["price_to_book_mrq"],
-				"EV/R": statsData["statistics"]["valuations_metrics"]["enterprise_to_revenue"],
-				"EV/EBITDA": statsData["statistics"]["valuations_metrics"]["enterprise_to_ebitda"]
+				"enterprise value": statsData["valuations_metrics"]["enterprise_value"],
+				"trailing PE": statsData["valuations_metrics"]["trailing_pe"],
+				"forward PE": statsData["valuations_metrics"]["forward_pe"],
+				"PEG": statsData["valuations_metrics"]["peg_ratio"],
+				"P/S": statsData["valuations_metrics"]["price_to_sales_ttm"],
+				"P/B": statsData["valuations_metrics"]["price_to_book_mrq"],
+				"EV/R": statsData["valuations_metrics"]["enterprise_to_revenue"],
+				"EV/EBITDA": statsData["valuations_metrics"]["enterprise_to_ebitda"]
 			},
 			"financials": {
-				"profit margin": statsData["statistics"]["financials"]["profit_margin"],
-				"operating margin": statsData["statistics"]["financials"]["operating_margin"],
-				"ROS": statsData["statistics"]["financials"]["return_on_assets_ttm"],
-				"ROE": statsData["statistics"]["financials"]["return_on_equity_ttm"],
+				"profit margin": statsData["financials"]["profit_margin"],
+				"operating margin": statsData["financials"]["operating_margin"],
+				"ROS": statsData["financials"]["return_on_assets_ttm"],
+				"ROE": statsData["financials"]["return_on_equity_ttm"],
 			},
-			"marketcap": statsData["statistics"]["valuations_metrics"]["market_capitalization"],
+			"marketcap": statsData["valuations_metrics"]["market_capitalization"],
 			"change": {
-				"past day": (closePrice[0] / openPrice[0] - 1) * 100,
-				"past month": (closePrice[0] / openPrice[-1] - 1) * 100,
-				"past 52w": statsData["statistics"]["stock_price_summary"]["fifty_two_week_change"] * 100
+				"past day": percent_change(closePrice[0], openPrice[0]),
+				"past month": percent_change(closePrice[0], openPrice[-1]),
+				"past 52w": statsData["stock_price_summary"]["fifty_two_week_change"] * 100
 			},
 			"sourceText": "Data provided by Twelvedata",
 			"platform": Twelvedata.name,
@@ -192,4 +294,20 @@ class Twelvedata(AbstractProvider):
 
 		if stockLogoThumbnail is not None: payload["image"] = stockLogoThumbnail
 
-		return payload, None
\ No newline at end of file
+		return payload, None
+
+	@staticmethod
+	async def _request_endpoint(endpoint, method, **kwargs):
+		await limiter.acquire(CREDITS[endpoint])
+		return await run_in_executor(Twelvedata.name, lambda: getattr(get_client(), method)(**kwargs).as_json())
+
+	@staticmethod
+	async def _request_statistics(ticker, exchange):
+		statsData = await Twelvedata._request_endpoint("statistics", "get_statistics", symbol=ticker.get("symbol"), exchange=exchange.get("name"))
+		# Newer clients unwrap the statistics object themselves
+		return statsData.get("statistics", statsData)
+
+	@staticmethod
+	async def _request_series(ticker, exchange):
+		rawData = await Twelvedata._request_endpoint("time_series", "time_series", symbol=ticker.get("symbol"), exchange=exchange.get("name"), interval="1day", outputsize=21, timezone="UTC")
+		return [[float(candle["close"]) for candle in rawData], [float(candle["open"]) for candle in rawData]]
@@ -0,0 +1,195 @@
+from time import time
+from asyncio import create_task, shield, wrap_future
+from functools import partial
+from threading import Lock
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from sqlite3 import connect
+from traceback import format_exc
+from orjson import dumps, loads, OPT_SORT_KEYS
+
+from helpers import metrics, shared
+
+
+class TTLCache(object):
+	def __init__(self, maxSize):
+		self.maxSize = maxSize
+		self.entries = OrderedDict()
+
+	def get(self, key):
+		entry = self.entries.get(key)
+		if entry is None: return None
+		expiresAt, value = entry
+		if expiresAt < time():
+			del self.entries[key]
+			return None
+		self.entries.move_to_end(key)
+		return value
+
+	def set(self, key, value, ttl):
+		self.entries[key] = (time() + ttl, value)
+		self.entries.move_to_end(key)
+		while len(self.entries) > self.maxSize:
+			self.entries.popitem(last=False)
+
+
+class QuoteCache(TTLCache):
+	def __init__(self, ttls, defaultTtl, maxSize):
+		super().__init__(maxSize)
+		self.ttls = ttls
+		self.defaultTtl = defaultTtl
+		self.inflight = {}
+
+	@staticmethod
+	def key(platform, request):
+		return dumps([platform, request], option=OPT_SORT_KEYS)
+
+	def ttl(self, platform):
+		return self.ttls.get(platform, self.defaultTtl)
+
+	async def fetch(self, platform, request, fetcher):
+		ttl = self.ttl(platform)
+		if ttl <= 0:
+			metrics.cacheLookups.labels("quotes", platform, "bypass").inc()
+			return await fetcher()
+
+		key = QuoteCache.key(platform, request)
+		cached = self.get(key)
+		if cached is not None:
+			metrics.cacheLookups.labels("quotes", platform, "hit").inc()
+			return cached
+
+		# Concurrent identical requests share a single upstream call
+		task = self.inflight.get(key)
+		if task is None:
+			metrics.cacheLookups.labels("quotes", platform, "miss").inc()
+			task = create_task(self._load(platform, key, ttl, fetcher))
+			self.inflight[key] = task
+			task.add_done_callback(partial(self._resolve, key, ttl))
+		else:
+			metrics.cacheLookups.labels("quotes", platform, "coalesced").inc()
+		return await shield(task)
+
+	async def _load(self, platform, key, ttl, fetcher):
+		cached = (await self.get_shared(platform, [key])).get(key)
+		if cached is not None: return cached
+		response = await fetcher()
+		if bool(response[0]):
+			await self.set_shared({key: response}, ttl)
+		return response
+
+	async def get_shared(self, platform, keys):
+		# Other worker processes may already hold the response in the shared store
+		if not shared.enabled(): return {}
+		found = {}
+		for key, entry in zip(keys, await shared.get_many([b"quotes:" + key for key in keys])):
+			if entry is None: continue
+			response, ttl = entry
+			found[key] = tuple(response)
+			self.set(key, found[key], ttl)
+		metrics.cacheLookups.labels("shared", platform, "hit").inc(len(found))
+		metrics.cacheLookups.labels("shared", platform, "miss").inc(len(keys) - len(found))
+		return found
+
+	async def set_shared(self, responses, ttl):
+		await shared.set_many({b"quotes:" + key: response for key, response in responses.items()}, ttl)
+
+	def _resolve(self, key, ttl, task):
+		self.inflight.pop(key, None)
+		if task.cancelled() or task.exception() is not None: return
+		payload, message = task.result()
+		if bool(payload):
+			self.set(key, (payload, message), ttl)
+
+
+class PersistentCache(object):
+	def __init__(self, name, maxSize, path=None):
+		self.name = name
+		self.memory = TTLCache(maxSize)
+		self.lock = Lock()
+		self.path = path
+		self.connection = None
+		self.writeConnection = None
+		self.executor = None
+		if path:
+			self.connection = connect(path, check_same_thread=False)
+			# Readers are not blocked by another worker process writing to the same file
+			self.connection.execute("PRAGMA journal_mode=WAL")
+			self.connection.execute(f"CREATE TABLE IF NOT EXISTS {name} (key TEXT PRIMARY KEY, value BLOB, expiresAt REAL)")
+			self.connection.commit()
+			# Reads and writes wait on the file on a thread of their own, so the event loop never touches SQLite
+			self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+
+	def get(self, key):
+		# Blocking lookup for callers that already run on a worker thread
+		value = self.get_memory(key)
+		if value is not None or self.connection is None: return value
+		return self.read(key)
+
+	async def get_async(self, key):
+		# The event loop is answered from memory, and only a miss waits on the file through the cache thread
+		value = self.get_memory(key)
+		if value is not None or self.connection is None: return value
+		return await wrap_future(self.executor.submit(self.read, key))
+
+	def get_memory(self, key):
+		with self.lock:
+			return self.memory.get(key)
+
+	def read(self, key):
+		# The lock only guards memory, so the event loop is never held up behind a file read on another thread
+		try:
+			row = self.connection.execute(f"SELECT value, expiresAt FROM {self.name} WHERE key = ?", (key,)).fetchone()
+		except:
+			print(format_exc())
+			return None
+		if row is None or row[1] < time(): return None
+		value = loads(row[0])
+		with self.lock:
+			self.memory.set(key, value, row[1] - time())
+		return value
+
+	def set(self, key, value, ttl):
+		with self.lock:
+			self.memory.set(key, value, ttl)
+		if self.executor is not None:
+			self.executor.submit(self.persist, key, dumps(value), time() + ttl)
+
+	def persist(self, key, value, expiresAt):
+		# A failed write only costs the persisted copy, the entry is already served from memory
+		try:
+			if self.writeConnection is None:
+				self.writeConnection = connect(self.path)
+			self.writeConnection.execute(f"INSERT OR REPLACE INTO {self.name} (key, value, expiresAt) VALUES (?, ?, ?)", (key, value, expiresAt))
+			self.writeConnection.commit()
+		except:
+			print(format_exc())
+
+
+class DetailCache(PersistentCache):
+	def __init__(self, name, platform, ttl, maxSize, path=None):
+		super().__init__(name, maxSize, path)
+		self.platform = platform
+		self.ttl = ttl
+		self.inflight = {}
+
+	async def fetch(self, key, loader):
+		cached = await self.get_async(key)
+		if cached is not None:
+			metrics.cacheLookups.labels(self.name, self.platform, "hit").inc()
+			return cached
+
+		task = self.inflight.get(key)
+		if task is None:
+			metrics.cacheLookups.labels(self.name, self.platform, "miss").inc()
+			task = create_task(loader())
+			self.inflight[key] = task
+			task.add_done_callback(partial(self._resolve, key))
+		else:
+			metrics.cacheLookups.labels(self.name, self.platform, "coalesced").inc()
+		return await shield(task)
+
+	def _resolve(self, key, task):
+		self.inflight.pop(key, None)
+		if task.cancelled() or task.exception() is not None or task.result() is None: return
+		self.set(key, task.result(), self.ttl)
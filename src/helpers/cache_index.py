@@ -0,0 +1,72 @@
+from os import environ
+from time import perf_counter
+
+from helpers.cache import TTLCache
+from helpers import metrics
+
+
+INDEX = "cache"
+READ_THROUGH_TTL = float(environ.get("CACHE_INDEX_READ_THROUGH_TTL", 1))
+
+client = None
+documents = TTLCache(maxSize=20000)
+
+
+def connection_options():
+	# A plain URL takes precedence over the cloud deployment, so the index can be pointed at a local instance
+	if environ.get("ELASTICSEARCH_URL"):
+		return {"hosts": [environ["ELASTICSEARCH_URL"]], "api_key": environ.get("ELASTICSEARCH_API_KEY")}
+	return {"cloud_id": environ["ELASTICSEARCH_CLOUD_ID"], "api_key": environ["ELASTICSEARCH_API_KEY"]}
+
+def get_client():
+	# The Elasticsearch package is slow to import, so it is only loaded once the index is first queried
+	global client
+	if client is None:
+		from elasticsearch import AsyncElasticsearch
+		client = AsyncElasticsearch(**connection_options(), connections_per_node=50)
+	return client
+
+async def get_document(docId):
+	cached = documents.get(docId)
+	metrics.cacheLookups.labels("cache_index", "CCXT", "miss" if cached is None else "hit").inc()
+	if cached is not None: return cached
+
+	startedAt, status = perf_counter(), "error"
+	try:
+		response = await get_client().options(ignore_status=404).get(index=INDEX, id=docId)
+		status = str(response.meta.status)
+	finally:
+		metrics.upstreamRequestSeconds.labels("elasticsearch", f"/{INDEX}/_doc", status).observe(perf_counter() - startedAt)
+	if not response.body.get("found"): return None
+
+	documents.set(docId, response["_source"], READ_THROUGH_TTL)
+	return response["_source"]
+
+async def get_documents(docIds):
+	results, misses = {}, []
+	for docId in set(docIds):
+		cached = documents.get(docId)
+		if cached is not None: results[docId] = cached
+		else: misses.append(docId)
+
+	metrics.cacheLookups.labels("cache_index", "CCXT", "hit").inc(len(results))
+	metrics.cacheLookups.labels("cache_index", "CCXT", "miss").inc(len(misses))
+	if len(misses) != 0:
+		startedAt, status = perf_counter(), "error"
+		try:
+			response = await get_client().mget(index=INDEX, ids=misses)
+			status = "200"
+		finally:
+			metrics.upstreamRequestSeconds.labels("elasticsearch", f"/{INDEX}/_mget", status).observe(perf_counter() - startedAt)
+		for document in response["docs"]:
+			if document.get("found"):
+				results[document["_id"]] = document["_source"]
+				documents.set(document["_id"], document["_source"], READ_THROUGH_TTL)
+
+	return results
+
+async def close():
+	global client
+	if client is not None:
+		await client.close()
+		client = None
@@ -0,0 +1,112 @@
+from os import environ
+from threading import Lock
+from collections import OrderedDict
+
+from numpy import empty, nansum
+
+from helpers.numeric import to_array, TIMESTAMP, OPEN, CLOSE, VOLUME
+
+
+CAPACITY = int(environ.get("OHLCV_BUFFER_SIZE", 150))
+STORE_SIZE = int(environ.get("OHLCV_STORE_SIZE", 5000))
+
+
+class CandleBuffer(object):
+	def __init__(self, capacity=CAPACITY):
+		self.capacity = capacity
+		self.rows = empty((capacity, 6))
+		# Sequence numbers only ever grow, the row of a candle is its sequence modulo the capacity
+		self.first = 0
+		self.next = 0
+		self.windowStart = 0
+		self.windowVolume = 0.0
+		self.lock = Lock()
+
+	def __len__(self):
+		return self.next - self.first
+
+	def row(self, sequence):
+		return self.rows[sequence % self.capacity]
+
+	def last_timestamp(self):
+		return None if self.next == self.first else int(self.row(self.next - 1)[TIMESTAMP])
+
+	def clear(self):
+		with self.lock:
+			self.first, self.next, self.windowStart = 0, 0, 0
+			self.windowVolume = 0.0
+
+	def merge(self, candles):
+		if len(candles) == 0: return
+		candles = to_array(candles, 6)
+		with self.lock:
+			if self.next == self.first:
+				# A cold buffer is filled in a single copy
+				candles = candles[-self.capacity:]
+				self.rows[:len(candles)] = candles
+				self.first, self.next, self.windowStart = 0, len(candles), 0
+				self.windowVolume = float(nansum(candles[:, VOLUME]))
+				return
+			for candle in candles:
+				self.upsert(candle)
+
+	def upsert(self, candle):
+		volume = 0.0 if candle[VOLUME] != candle[VOLUME] else candle[VOLUME]
+		if self.next != self.first:
+			lastTimestamp = self.row(self.next - 1)[TIMESTAMP]
+			if candle[TIMESTAMP] < lastTimestamp:
+				return
+			elif candle[TIMESTAMP] == lastTimestamp:
+				# The newest candle is still forming, so it is replaced in place
+				self.windowVolume += volume - self.volume(self.next - 1)
+				self.rows[(self.next - 1) % self.capacity] = candle
+				return
+
+		if self.next - self.first == self.capacity:
+			if self.windowStart == self.first:
+				self.windowVolume -= self.volume(self.first)
+				self.windowStart += 1
+			self.first += 1
+		self.rows[self.next % self.capacity] = candle
+		self.next += 1
+		self.windowVolume += volume
+
+	def volume(self, sequence):
+		volume = self.row(sequence)[VOLUME]
+		return 0.0 if volume != volume else volume
+
+	def summary(self, since, candleOffset):
+		with self.lock:
+			while self.windowStart < self.next and self.row(self.windowStart)[TIMESTAMP] < since:
+				self.windowVolume -= self.volume(self.windowStart)
+				self.windowStart += 1
+			windowSize = self.next - self.windowStart
+			if windowSize == 0: return None
+
+			close = self.row(self.next - 1)[CLOSE]
+			periodOpen = self.row(self.windowStart if windowSize < candleOffset else self.next - candleOffset)[OPEN]
+			if close != close or periodOpen != periodOpen: return None
+			return float(close), float(periodOpen), max(0.0, float(self.windowVolume))
+
+
+class CandleStore(object):
+	def __init__(self, maxSize=STORE_SIZE):
+		self.maxSize = maxSize
+		self.buffers = OrderedDict()
+		self.lock = Lock()
+
+	def get(self, exchangeId, symbol, timeframe):
+		key = (exchangeId, symbol, timeframe)
+		with self.lock:
+			buffer = self.buffers.get(key)
+			if buffer is None:
+				buffer = CandleBuffer()
+				self.buffers[key] = buffer
+				if len(self.buffers) > self.maxSize:
+					self.buffers.popitem(last=False)
+			else:
+				self.buffers.move_to_end(key)
+			return buffer
+
+
+candleStore = CandleStore()
@@ -0,0 +1,131 @@
+from os import environ
+from time import time
+from asyncio import Lock
+from importlib import import_module
+from traceback import format_exc
+
+from helpers.executors import run_in_executor
+from helpers import metrics, shared
+
+
+PROXY_BLACKLIST = ["htx"]
+MARKETS_REFRESH_INTERVAL = int(environ.get("CCXT_MARKETS_REFRESH_INTERVAL", 3600))
+IDLE_TIMEOUT = int(environ.get("CCXT_IDLE_TIMEOUT", 1800))
+SWEEP_INTERVAL = 60
+
+
+class PoolEntry(object):
+	def __init__(self, instance, lock):
+		self.instance = instance
+		self.lock = lock
+		self.lastUsed = time()
+		self.marketsLoadedAt = None
+
+
+class AsyncExchangePool(object):
+	def __init__(self, moduleName="ccxt.async_support", refreshInterval=MARKETS_REFRESH_INTERVAL, idleTimeout=IDLE_TIMEOUT):
+		self.moduleName = moduleName
+		self._module = None
+		self.refreshInterval = refreshInterval
+		self.idleTimeout = idleTimeout
+		self.entries = {}
+		self.lastSweep = time()
+
+	@property
+	def module(self):
+		# ccxt takes a third of a second to import, so it is only loaded once an exchange is first needed
+		if self._module is None:
+			self._module = import_module(self.moduleName)
+		return self._module
+
+	async def load_module(self):
+		# Callers on the event loop import the module on an executor thread first
+		if self._module is None:
+			self._module = await run_in_executor("CCXT", import_module, self.moduleName)
+		return self._module
+
+	@staticmethod
+	def get_proxy(exchangeId):
+		if exchangeId in PROXY_BLACKLIST or not environ.get("PROXY_IP"): return None
+		return f"http://{environ['PROXY_IP']}"
+
+	def create_instance(self, exchangeId, proxy):
+		if proxy is None:
+			return getattr(self.module, exchangeId)()
+		return getattr(self.module, exchangeId)({
+			"aiohttp_proxy": proxy
+		})
+
+	def instrument(self, instance):
+		instance.fetch = metrics.timed_fetch(instance.fetch)
+		return instance
+
+	async def load_markets(self, instance, exchangeId, reload):
+		# Market tables are identical across instances, so a worker reuses whatever another worker loaded within the refresh interval
+		entry = await shared.get(f"markets:{exchangeId}")
+		if entry is not None:
+			instance.set_markets(*entry[0])
+			return
+		await instance.load_markets(reload=reload)
+		await shared.set(f"markets:{exchangeId}", [instance.markets, instance.currencies], self.refreshInterval)
+
+	def evict_idle(self, now):
+		self.lastSweep = now
+		evicted = []
+		for key in [key for key, entry in self.entries.items() if now - entry.lastUsed > self.idleTimeout]:
+			evicted.append(self.entries.pop(key))
+		return evicted
+
+	async def acquire(self, exchangeId):
+		now = time()
+		key = (exchangeId, self.get_proxy(exchangeId))
+
+		if now - self.lastSweep > SWEEP_INTERVAL:
+			for entry in self.evict_idle(now):
+				await entry.instance.close()
+		entry = self.entries.get(key)
+		if entry is None:
+			await self.load_module()
+			entry = PoolEntry(self.instrument(self.create_instance(*key)), Lock())
+			self.entries[key] = entry
+		entry.lastUsed = now
+
+		if entry.marketsLoadedAt is None or now - entry.marketsLoadedAt > self.refreshInterval:
+			async with entry.lock:
+				if entry.marketsLoadedAt is None or now - entry.marketsLoadedAt > self.refreshInterval:
+					try:
+						await self.load_markets(entry.instance, exchangeId, entry.marketsLoadedAt is not None)
+						entry.marketsLoadedAt = now
+					except:
+						# Stale markets are still usable, and a failed cold load is retried by the next data call
+						print(format_exc())
+
+		return entry.instance
+
+	async def close(self):
+		entries, self.entries = self.entries, {}
+		for entry in entries.values():
+			await entry.instance.close()
+
+
+class StreamExchangePool(AsyncExchangePool):
+	def __init__(self, moduleName="ccxt.pro", refreshInterval=MARKETS_REFRESH_INTERVAL):
+		# Websocket instances are held open by their watchers, so they are released explicitly instead of idling out
+		super().__init__(moduleName, refreshInterval, float("inf"))
+
+	def create_instance(self, exchangeId, proxy):
+		if proxy is None:
+			return getattr(self.module, exchangeId)()
+		return getattr(self.module, exchangeId)({
+			"aiohttp_proxy": proxy,
+			"ws_proxy": proxy
+		})
+
+	async def release(self, exchangeId):
+		entry = self.entries.pop((exchangeId, self.get_proxy(exchangeId)), None)
+		if entry is not None:
+			await entry.instance.close()
+
+
+asyncExchangePool = AsyncExchangePool()
+streamExchangePool = StreamExchangePool()
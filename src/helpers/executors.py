@@ -0,0 +1,92 @@
+from os import environ
+from time import perf_counter
+from asyncio import wait_for, wrap_future, TimeoutError
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from orjson import loads
+
+from helpers import metrics
+
+
+DEFAULT_BULKHEAD = [
+	int(environ.get("BULKHEAD_WORKERS", 4)),
+	int(environ.get("BULKHEAD_QUEUE", 32)),
+	float(environ.get("BULKHEAD_TIMEOUT", 10)),
+]
+
+# Worker threads, calls allowed to queue behind them, and seconds a caller waits, per upstream
+BULKHEADS = {
+	"Twelvedata": [8, 64, 15],
+	**loads(environ.get("BULKHEADS", "{}"))
+}
+
+bulkheads = {}
+bulkheadsLock = Lock()
+
+
+class BulkheadFull(Exception):
+	pass
+
+
+class Bulkhead(object):
+	def __init__(self, platform, workers, queue, timeout):
+		self.platform = platform
+		self.capacity = workers + queue
+		self.timeout = timeout
+		self.pending = 0
+		self.lock = Lock()
+		self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=platform)
+		metrics.executorCapacity.labels(platform).set(self.capacity)
+
+	def admit(self):
+		with self.lock:
+			if self.pending >= self.capacity: return False
+			self.pending += 1
+			metrics.executorInflight.labels(self.platform).set(self.pending)
+			return True
+
+	def release(self, future):
+		with self.lock:
+			self.pending -= 1
+			metrics.executorInflight.labels(self.platform).set(self.pending)
+
+	async def run(self, executor, function, *args):
+		# A full bulkhead rejects right away instead of queueing behind an upstream that stopped answering
+		if not self.admit():
+			metrics.executorRejected.labels(self.platform, "full").inc()
+			raise BulkheadFull(f"{self.platform} executor is full")
+
+		future = executor.submit(function, *args)
+		# The slot is held until the call actually returns, so a hung upstream only ever fills its own bulkhead
+		future.add_done_callback(self.release)
+		try:
+			return await wait_for(wrap_future(future), self.timeout)
+		except TimeoutError:
+			metrics.executorRejected.labels(self.platform, "timeout").inc()
+			raise
+
+	def close(self):
+		self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def get_bulkhead(platform):
+	with bulkheadsLock:
+		if platform not in bulkheads:
+			bulkheads[platform] = Bulkhead(platform, *BULKHEADS.get(platform, DEFAULT_BULKHEAD))
+		return bulkheads[platform]
+
+async def run_in_executor(platform, function, *args):
+	submittedAt = perf_counter()
+
+	def run():
+		metrics.executorWaitSeconds.labels(platform).observe(perf_counter() - submittedAt)
+		return function(*args)
+
+	bulkhead = get_bulkhead(platform)
+	return await bulkhead.run(bulkhead.executor, run)
+
+def close():
+	with bulkheadsLock:
+		for bulkhead in bulkheads.values():
+			bulkhead.close()
+		bulkheads.clear()
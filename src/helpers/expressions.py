@@ -0,0 +1,90 @@
+from operator import add, sub, mul, truediv
+from collections import OrderedDict
+from orjson import dumps, OPT_SORT_KEYS
+
+
+CACHE_SIZE = 4096
+CONSTANT, VARIABLE, NEGATE, BINARY = range(4)
+BINARY_OPERATORS = {
+	"add": add,
+	"sub": sub,
+	"mul": mul,
+	"div": truediv,
+	"exp": pow,
+}
+
+# Marks a channel that divided by zero, which evaluates to 0 as a whole
+DIVERGED = object()
+
+
+class Expression(object):
+	def __init__(self, program, leaves):
+		self.program = program
+		self.leaves = leaves
+
+	def evaluate(self, variables):
+		stack = []
+		for opcode, argument in self.program:
+			if opcode == VARIABLE:
+				raw = variables[argument]
+				stack.append((raw.get("quotePrice", [0])[0], raw.get("quoteVolume", [0])[0]))
+			elif opcode == CONSTANT:
+				stack.append(argument)
+			elif opcode == BINARY:
+				right = stack.pop()
+				left = stack.pop()
+				stack.append((apply_binary(argument, left[0], right[0]), apply_binary(argument, left[1], right[1])))
+			else:
+				price, volume = stack.pop()
+				stack.append((apply_unary(price), apply_unary(volume)))
+
+		price, volume = stack.pop()
+		return 0 if price is DIVERGED else price, 0 if volume is DIVERGED else volume
+
+
+def apply_unary(value):
+	return DIVERGED if value is DIVERGED else -value
+
+def apply_binary(operator, left, right):
+	if left is DIVERGED or right is DIVERGED: return DIVERGED
+	try: return operator(left, right)
+	except ZeroDivisionError: return DIVERGED
+
+
+expressions = OrderedDict()
+
+def compile_expression(tree):
+	key = dumps(tree, option=OPT_SORT_KEYS)
+	expression = expressions.get(key)
+	if expression is not None:
+		expressions.move_to_end(key)
+		return expression
+
+	program, leaves = [], {}
+	emit(tree, program, leaves)
+	expression = Expression(program, leaves)
+
+	expressions[key] = expression
+	if len(expressions) > CACHE_SIZE:
+		expressions.popitem(last=False)
+	return expression
+
+def emit(node, program, leaves):
+	rule, children = node
+	if rule == "number":
+		value = float(children[0][1])
+		program.append((CONSTANT, (value, value)))
+	elif rule == "var":
+		ticker = children[0][1]
+		hashName = dumps(ticker, option=OPT_SORT_KEYS)
+		leaves.setdefault(hashName, ticker)
+		program.append((VARIABLE, hashName))
+	elif rule == "neg":
+		emit(children[0], program, leaves)
+		program.append((NEGATE, None))
+	elif rule in BINARY_OPERATORS:
+		emit(children[0], program, leaves)
+		emit(children[1], program, leaves)
+		program.append((BINARY, BINARY_OPERATORS[rule]))
+	else:
+		raise ValueError(f"Unsupported expression rule: {rule}")
@@ -0,0 +1,49 @@
+from os import environ
+from random import uniform
+from asyncio import sleep
+from importlib.util import find_spec
+
+from httpx import AsyncClient, Limits, Timeout, TransportError
+
+from helpers import metrics
+
+
+RETRIES = int(environ.get("HTTP_RETRIES", 2))
+BACKOFF = float(environ.get("HTTP_BACKOFF", 0.1))
+RETRY_STATUSES = [429, 502, 503, 504]
+TIMEOUT = Timeout(10.0, connect=5.0)
+# HTTP/2 is used wherever the optional h2 package is installed
+HTTP2 = find_spec("h2") is not None
+
+client = None
+
+
+def get_client():
+	global client
+	if client is None or client.is_closed:
+		client = AsyncClient(
+			http2=HTTP2,
+			timeout=TIMEOUT,
+			limits=Limits(max_connections=200, max_keepalive_connections=50),
+			event_hooks={"request": [metrics.on_httpx_request], "response": [metrics.on_httpx_response]},
+		)
+	return client
+
+def backoff(attempt):
+	# Full jitter keeps retries from many callers from arriving in lockstep
+	return uniform(0, BACKOFF * 2 ** attempt)
+
+async def get(url, **kwargs):
+	for attempt in range(RETRIES + 1):
+		try:
+			response = await get_client().get(url, **kwargs)
+			if response.status_code not in RETRY_STATUSES or attempt == RETRIES: return response
+		except TransportError:
+			if attempt == RETRIES: raise
+		await sleep(backoff(attempt))
+
+async def close():
+	global client
+	if client is not None:
+		await client.aclose()
+		client = None
@@ -0,0 +1,78 @@
+from os import environ, getpid, listdir, remove
+from os.path import join
+from time import perf_counter
+from tempfile import mkdtemp
+from urllib.parse import urlsplit
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, make_asgi_app
+from prometheus_client.multiprocess import MultiProcessCollector, mark_process_dead
+
+
+# Set by the parent process before it starts the workers, since prometheus_client reads it on import
+MULTIPROCESS = bool(environ.get("PROMETHEUS_MULTIPROC_DIR"))
+FAST_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025)
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+rateLimitQueueDepth = Gauge("quote_server_rate_limit_queue_depth", "Requests waiting for a rate limit token", ["limiter"], multiprocess_mode="livesum")
+rateLimitShed = Counter("quote_server_rate_limit_shed_total", "Requests rejected by a rate limiter", ["limiter"])
+
+treeCompileSeconds = Histogram("quote_server_tree_compile_seconds", "Time to compile a ticker expression tree", ["platform"], buckets=FAST_BUCKETS)
+treeEvaluateSeconds = Histogram("quote_server_tree_evaluate_seconds", "Time to evaluate a compiled expression over its leaves", ["platform"], buckets=FAST_BUCKETS)
+providerRequestSeconds = Histogram("quote_server_provider_request_seconds", "Time for a provider to produce a single quote", ["platform", "exchange"], buckets=REQUEST_BUCKETS)
+upstreamRequestSeconds = Histogram("quote_server_upstream_request_seconds", "Time for a single upstream HTTP call", ["host", "endpoint", "status"], buckets=REQUEST_BUCKETS)
+executorWaitSeconds = Histogram("quote_server_executor_wait_seconds", "Time a blocking call waited for an executor thread", ["platform"], buckets=REQUEST_BUCKETS)
+executorInflight = Gauge("quote_server_executor_inflight", "Blocking calls admitted to a provider's executor and not yet finished", ["platform"], multiprocess_mode="livesum")
+executorCapacity = Gauge("quote_server_executor_capacity", "Blocking calls a provider's executor admits before rejecting", ["platform"], multiprocess_mode="livesum")
+executorRejected = Counter("quote_server_executor_rejected_total", "Blocking calls rejected by a full executor or abandoned past their deadline", ["platform", "reason"])
+cacheLookups = Counter("quote_server_cache_lookups_total", "Cache lookups by outcome", ["cache", "platform", "result"])
+
+
+def prepare_multiprocess():
+	# Samples left behind by a previous run would otherwise be merged into the new one
+	if not environ.get("PROMETHEUS_MULTIPROC_DIR"):
+		environ["PROMETHEUS_MULTIPROC_DIR"] = mkdtemp(prefix="prometheus-")
+	directory = environ["PROMETHEUS_MULTIPROC_DIR"]
+	for name in listdir(directory):
+		if name.endswith(".db"): remove(join(directory, name))
+
+def make_app():
+	if not MULTIPROCESS: return make_asgi_app()
+	# Every worker writes its samples to the shared directory, so whichever worker takes a scrape reports all of them
+	registry = CollectorRegistry()
+	MultiProcessCollector(registry)
+	return make_asgi_app(registry)
+
+def close():
+	if MULTIPROCESS: mark_process_dead(getpid())
+
+def endpoint_of(url):
+	# Only the leading path segments are kept, so ids in the path do not explode the label cardinality
+	parts = urlsplit(str(url))
+	return parts.hostname or "", "/" + "/".join(parts.path.strip("/").split("/")[:3])
+
+def observe_upstream(url, status, seconds):
+	host, endpoint = endpoint_of(url)
+	upstreamRequestSeconds.labels(host, endpoint, str(status)).observe(seconds)
+
+def timed_fetch(fetch):
+	# ccxt sends every REST call through its own fetch method and session, and only returns for successful responses
+	async def wrapper(url, *args, **kwargs):
+		startedAt, status = perf_counter(), "error"
+		try:
+			response = await fetch(url, *args, **kwargs)
+			status = "ok"
+			return response
+		finally:
+			observe_upstream(url, status, perf_counter() - startedAt)
+	return wrapper
+
+async def on_httpx_request(request):
+	request.extensions["startedAt"] = perf_counter()
+
+async def on_httpx_response(response):
+	startedAt = response.request.extensions.get("startedAt")
+	if startedAt is not None:
+		observe_upstream(response.request.url, response.status_code, perf_counter() - startedAt)
+
+def on_requests_response(response, *args, **kwargs):
+	observe_upstream(response.url, response.status_code, response.elapsed.total_seconds())
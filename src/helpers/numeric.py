@@ -0,0 +1,26 @@
+from numpy import asarray, float64, isnan, nanmax, nanmin
+
+
+TIMESTAMP, OPEN, HIGH, LOW, CLOSE, VOLUME = range(6)
+
+
+def to_array(rows, width=None):
+	# Upstream rows are converted once, with missing values becoming NaN
+	array = asarray(rows, dtype=float64)
+	if array.ndim == 1: array = array.reshape(-1, width or 1)
+	return array if width is None else array[:, :width]
+
+def frame_columns(frame, columns):
+	return frame[columns].to_numpy(dtype=float64)
+
+def highest(values):
+	if len(values) == 0 or isnan(values).all(): return None
+	return float(nanmax(values))
+
+def lowest(values):
+	if len(values) == 0 or isnan(values).all(): return None
+	return float(nanmin(values))
+
+def percent_change(latest, reference):
+	if reference == 0 or reference != reference or latest != latest: return 0
+	return (latest / reference - 1) * 100
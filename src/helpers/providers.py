@@ -0,0 +1,115 @@
+from os import environ
+from time import monotonic
+from asyncio import create_task, gather, shield, TimeoutError
+from importlib import import_module
+from threading import Lock
+from traceback import format_exc
+
+from helpers.executors import run_in_executor, BulkheadFull
+
+
+QUOTE = "quote"
+DETAIL = "detail"
+BATCH = "batch"
+
+# Providers are imported on first use, since each one pulls in its own SDK and upstream clients
+MODULES = {
+	"Alternative.me": "components.alternativeme",
+	"Blockchair": "components.blockchair",
+	"CNN Business": "components.cnnbusiness",
+	"CoinGecko": "components.coingecko",
+	"On-Chain": "components.chain",
+	"CCXT": "components.ccxt",
+	"Twelvedata": "components.twelvedata",
+	**{platform: moduleName for platform, moduleName in (item.split("=", 1) for item in environ.get("PROVIDER_MODULES", "").split(",") if "=" in item)}
+}
+WARMUP = [platform.strip() for platform in environ.get("PROVIDER_WARMUP", "").split(",") if platform.strip()]
+DEFAULT_LATENCY = 1.0
+# Seconds before a provider that failed to import is tried again
+LOAD_RETRY = int(environ.get("PROVIDER_LOAD_RETRY", 60))
+
+registry = {}
+lock = Lock()
+loading = {}
+failedAt = {}
+warmup = None
+
+
+class Provider(object):
+	def __init__(self, name, implementation, capabilities, latency):
+		self.name = name
+		self.implementation = implementation
+		self.capabilities = capabilities
+		self.latency = latency
+
+	def supports(self, capability):
+		return capability in self.capabilities
+
+	async def request_quote(self, request):
+		if not self.supports(QUOTE): return {}, None
+		try:
+			# Providers run on the event loop and move their own blocking calls onto their bulkhead
+			return await self.implementation.request_quote_async(request)
+		except (BulkheadFull, TimeoutError):
+			# A saturated or stalled upstream answers empty, so the next platform is tried right away
+			return None, None
+
+	async def request_quotes(self, requests):
+		if self.supports(BATCH):
+			try:
+				return await self.implementation.request_quote_batch_async(requests)
+			except (BulkheadFull, TimeoutError):
+				return [(None, None)] * len(requests)
+		return await gather(*[self.request_quote(request) for request in requests])
+
+	async def request_details(self, request):
+		if not self.supports(DETAIL): return None, None
+		try:
+			return await self.implementation.request_details(request)
+		except (BulkheadFull, TimeoutError):
+			return None, None
+
+
+def register(capabilities, latency=DEFAULT_LATENCY):
+	# Latency is the expected time to answer a quote, and doubles as the hedging budget before the next platform is tried
+	def decorator(implementation):
+		registry[implementation.name] = Provider(implementation.name, implementation, set(capabilities), latency)
+		return implementation
+	return decorator
+
+def import_provider(platform):
+	with lock:
+		import_module(MODULES[platform])
+	return registry.get(platform)
+
+async def load(platform):
+	provider = registry.get(platform)
+	if provider is not None or platform not in MODULES: return provider
+	if platform in failedAt and monotonic() - failedAt[platform] < LOAD_RETRY: return None
+
+	# Concurrent requests for a provider that is still importing wait on the same import
+	task = loading.get(platform)
+	if task is None:
+		task = create_task(load_in_executor(platform))
+		loading[platform] = task
+	return await shield(task)
+
+async def load_in_executor(platform):
+	# Provider SDKs take hundreds of milliseconds to import, so the import runs on the provider's executor instead of the event loop
+	try:
+		return await run_in_executor(platform, import_provider, platform)
+	except:
+		print(format_exc())
+		failedAt[platform] = monotonic()
+		return None
+	finally:
+		loading.pop(platform, None)
+
+async def warm_up(platforms):
+	await gather(*[load(platform) for platform in platforms])
+
+def start_warm_up(platforms=WARMUP):
+	# Runs after the server is accepting requests, so readiness does not wait on it
+	global warmup
+	if warmup is None and len(platforms) != 0:
+		warmup = create_task(warm_up(platforms))
@@ -0,0 +1,232 @@
+from os import environ
+from time import time, monotonic, sleep as blocking_sleep
+from asyncio import get_running_loop, create_task, sleep, wait_for, CancelledError, TimeoutError
+from contextvars import ContextVar
+from hashlib import sha1
+from heapq import heappush, heappop, heapify
+from itertools import count
+from threading import Lock
+from traceback import format_exc
+from orjson import loads
+from redis import Redis
+from redis.asyncio import Redis as AsyncRedis
+
+from helpers import metrics, shared
+
+
+PRIORITY_QUOTE = 0
+PRIORITY_DETAIL = 1
+MAX_QUEUE = int(environ.get("RATE_LIMIT_MAX_QUEUE", 500))
+MAX_WAIT = float(environ.get("RATE_LIMIT_MAX_WAIT", 5))
+RETRY_DELAY = 0.05
+# A store every replica reaches enforces the full limit, while the pod-local shared store only spans this pod's workers
+REDIS_URL = environ.get("RATE_LIMIT_REDIS_URL")
+SHARED_STORE_URL = environ.get("SHARED_STORE_URL")
+WORKERS = int(environ.get("WORKERS", 1))
+REPLICAS = int(environ.get("REPLICAS", 1))
+
+# Sustained rate in requests (or credits) per second and burst size per upstream
+RATE_LIMITS = {
+	"CoinGecko": [8, 20],
+	"Twelvedata": [13, 800],
+	"CCXT": [10, 20],
+	**loads(environ.get("RATE_LIMITS", "{}"))
+}
+
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local now = tonumber(ARGV[4])
+local state = redis.call("HMGET", KEYS[1], "tokens", "updatedAt")
+local tokens = tonumber(state[1]) or burst
+local updatedAt = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updatedAt) * rate)
+local wait = 0
+if tokens >= cost then
+	tokens = tokens - cost
+else
+	wait = (cost - tokens) / rate
+end
+redis.call("HSET", KEYS[1], "tokens", tokens, "updatedAt", now)
+redis.call("EXPIRE", KEYS[1], math.ceil(burst / rate) + 60)
+return tostring(wait)
+"""
+
+requestPriority = ContextVar("requestPriority", default=PRIORITY_QUOTE)
+
+
+class RateLimitExceeded(Exception):
+	pass
+
+
+class LocalBucket(object):
+	def __init__(self, rate, burst):
+		self.rate = rate
+		self.burst = burst
+		self.tokens = burst
+		self.updatedAt = monotonic()
+		self.lock = Lock()
+
+	def take(self, cost):
+		with self.lock:
+			now = monotonic()
+			self.tokens = min(self.burst, self.tokens + (now - self.updatedAt) * self.rate)
+			self.updatedAt = now
+			if self.tokens >= cost:
+				self.tokens -= cost
+				return 0
+			return (cost - self.tokens) / self.rate
+
+	async def take_async(self, cost):
+		return self.take(cost)
+
+
+class RedisStore(object):
+	def __init__(self, url):
+		# Same timeouts and backoff as the shared store, so a hung store costs one timeout every few seconds
+		self.client = Redis.from_url(url, socket_timeout=shared.SOCKET_TIMEOUT, socket_connect_timeout=shared.SOCKET_TIMEOUT)
+		self.asyncClient = AsyncRedis.from_url(url, socket_timeout=shared.SOCKET_TIMEOUT, socket_connect_timeout=shared.SOCKET_TIMEOUT)
+		self.unavailableUntil = 0
+
+	def enabled(self):
+		return monotonic() > self.unavailableUntil
+
+	def mark_unavailable(self):
+		print(format_exc())
+		self.unavailableUntil = monotonic() + shared.RETRY_AFTER
+
+
+class RedisBucket(object):
+	def __init__(self, key, rate, burst, store, processes):
+		self.key = key
+		self.rate = rate
+		self.burst = burst
+		self.store = store
+		self.script = store.client.register_script(TOKEN_BUCKET_SCRIPT)
+		self.asyncScript = store.asyncClient.register_script(TOKEN_BUCKET_SCRIPT)
+		# Used whenever the store is unreachable, so an outage degrades to each process keeping to its share
+		self.fallback = LocalBucket(rate / processes, max(1, burst / processes))
+
+	def take(self, cost):
+		if not self.store.enabled(): return self.fallback.take(cost)
+		try:
+			return float(self.script(keys=[self.key], args=[self.rate, self.burst, cost, time()]))
+		except:
+			self.store.mark_unavailable()
+			return self.fallback.take(cost)
+
+	async def take_async(self, cost):
+		if not self.store.enabled(): return self.fallback.take(cost)
+		try:
+			return float(await self.asyncScript(keys=[self.key], args=[self.rate, self.burst, cost, time()]))
+		except:
+			self.store.mark_unavailable()
+			return self.fallback.take(cost)
+
+
+class RateLimiter(object):
+	def __init__(self, name, bucket, maxQueue=MAX_QUEUE, maxWait=MAX_WAIT):
+		self.name = name
+		self.bucket = bucket
+		self.maxQueue = maxQueue
+		self.maxWait = maxWait
+		self.waiters = []
+		self.sequence = count()
+		self.dispatcher = None
+		# Tokens already taken for waiters that timed out before they were granted
+		self.spare = 0
+
+	async def acquire(self, cost=1):
+		if len(self.waiters) == 0 and await self.bucket.take_async(cost) == 0:
+			return
+
+		if len(self.waiters) >= self.maxQueue:
+			metrics.rateLimitShed.labels(self.name).inc()
+			raise RateLimitExceeded(f"{self.name} request queue is full")
+
+		future = get_running_loop().create_future()
+		heappush(self.waiters, (requestPriority.get(), next(self.sequence), cost, future))
+		metrics.rateLimitQueueDepth.labels(self.name).set(len(self.waiters))
+		if self.dispatcher is None or self.dispatcher.done():
+			self.dispatcher = create_task(self.dispatch())
+
+		try:
+			await wait_for(future, self.maxWait)
+		except TimeoutError:
+			metrics.rateLimitShed.labels(self.name).inc()
+			raise RateLimitExceeded(f"{self.name} rate limit wait exceeded {self.maxWait} seconds")
+
+	async def dispatch(self):
+		# Waiters are granted tokens strictly in priority order, then in arrival order
+		while len(self.waiters) != 0:
+			entry = self.waiters[0]
+			priority, sequence, cost, future = entry
+			if future.done():
+				heappop(self.waiters)
+				continue
+			try:
+				if self.spare >= cost:
+					self.spare, delay = self.spare - cost, 0
+				else:
+					delay = await self.bucket.take_async(cost)
+			except CancelledError:
+				raise
+			except:
+				print(format_exc())
+				delay = RETRY_DELAY
+
+			if delay == 0:
+				# Other waiters may have been queued ahead of this one while the bucket was being read
+				self.waiters.remove(entry)
+				heapify(self.waiters)
+				if future.done():
+					# The waiter gave up while its tokens were being taken, so they go to the next one instead
+					self.spare += cost
+				else:
+					future.set_result(None)
+			else:
+				await sleep(delay)
+			metrics.rateLimitQueueDepth.labels(self.name).set(len(self.waiters))
+
+	def acquire_sync(self, cost=1):
+		# Executor threads cannot join the priority queue, so they only take tokens the queue leaves over
+		deadline = monotonic() + self.maxWait
+		while True:
+			delay = self.bucket.take(cost) if len(self.waiters) == 0 else 0.05
+			if delay == 0: return
+			if monotonic() + delay > deadline:
+				metrics.rateLimitShed.labels(self.name).inc()
+				raise RateLimitExceeded(f"{self.name} rate limit wait exceeded {self.maxWait} seconds")
+			blocking_sleep(delay)
+
+
+limiters = {}
+limitersLock = Lock()
+stores = {}
+
+def fingerprint(apiKey):
+	return sha1(apiKey.encode()).hexdigest()[:12]
+
+def get_store(url):
+	# Buckets on the same store share its clients and its backoff
+	if url not in stores:
+		stores[url] = RedisStore(url)
+	return stores[url]
+
+def get_limiter(upstream, scope=None):
+	# Limits are tracked per upstream and per API key or exchange, configurable at either level
+	name = upstream if scope is None else f"{upstream}:{scope}"
+	with limitersLock:
+		if name not in limiters:
+			rate, burst = RATE_LIMITS.get(name, RATE_LIMITS.get(upstream, [10, 20]))
+			if REDIS_URL is not None:
+				bucket = RedisBucket(f"ratelimit:{name}", rate, burst, get_store(REDIS_URL), WORKERS * REPLICAS)
+			elif SHARED_STORE_URL is not None:
+				# The pod-local store is shared by this pod's workers only, so every replica keeps to its share of the limit
+				bucket = RedisBucket(f"ratelimit:{name}", rate / REPLICAS, max(1, burst / REPLICAS), get_store(SHARED_STORE_URL), WORKERS)
+			else:
+				# Without any shared store each worker process keeps to its share of the limit
+				bucket = LocalBucket(rate / (WORKERS * REPLICAS), max(1, burst / (WORKERS * REPLICAS)))
+			limiters[name] = RateLimiter(name, bucket)
+		return limiters[name]
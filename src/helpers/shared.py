@@ -0,0 +1,75 @@
+from os import environ
+from time import time, monotonic
+from traceback import format_exc
+from orjson import dumps, loads, OPT_SERIALIZE_NUMPY
+from redis.asyncio import Redis as AsyncRedis
+
+
+# A store local to the pod (a Redis sidecar) lets every worker process reuse each other's upstream results
+SHARED_STORE_URL = environ.get("SHARED_STORE_URL")
+KEY_PREFIX = b"quote-server:"
+SOCKET_TIMEOUT = float(environ.get("SHARED_STORE_TIMEOUT", 0.25))
+RETRY_AFTER = 5
+
+client = None
+unavailableUntil = 0
+
+
+def enabled():
+	return SHARED_STORE_URL is not None and monotonic() > unavailableUntil
+
+def get_client():
+	global client
+	if client is None:
+		client = AsyncRedis.from_url(SHARED_STORE_URL, socket_timeout=SOCKET_TIMEOUT, socket_connect_timeout=SOCKET_TIMEOUT)
+	return client
+
+def make_key(key):
+	return KEY_PREFIX + (key if isinstance(key, bytes) else key.encode())
+
+def encode(value, ttl):
+	return dumps([time() + ttl, value], option=OPT_SERIALIZE_NUMPY)
+
+def decode(raw):
+	# Entries carry their own expiry, so a value copied into a process cache never outlives the shared one
+	if raw is None: return None
+	expiresAt, value = loads(raw)
+	ttl = expiresAt - time()
+	if ttl <= 0: return None
+	return value, ttl
+
+def mark_unavailable():
+	# A missing sidecar should cost one timeout every few seconds, not one per request
+	global unavailableUntil
+	print(format_exc())
+	unavailableUntil = monotonic() + RETRY_AFTER
+
+async def get_many(keys):
+	if len(keys) == 0 or not enabled(): return [None] * len(keys)
+	try:
+		return [decode(raw) for raw in await get_client().mget([make_key(key) for key in keys])]
+	except:
+		mark_unavailable()
+		return [None] * len(keys)
+
+async def set_many(entries, ttl):
+	if len(entries) == 0 or not enabled(): return
+	try:
+		pipeline = get_client().pipeline(transaction=False)
+		for key, value in entries.items():
+			pipeline.set(make_key(key), encode(value, ttl), px=int(ttl * 1000))
+		await pipeline.execute()
+	except:
+		mark_unavailable()
+
+async def get(key):
+	return (await get_many([key]))[0]
+
+async def set(key, value, ttl):
+	await set_many({key: value}, ttl)
+
+async def close():
+	global client
+	if client is not None:
+		await client.aclose()
+		client = None
@@ -0,0 +1,76 @@
+from time import time
+from asyncio import create_task, shield, sleep, CancelledError
+from traceback import format_exc
+
+
+SCHEDULER_TICK = 1
+
+
+class Snapshot(object):
+	def __init__(self, loader, interval, maxStale):
+		self.loader = loader
+		self.interval = interval
+		self.maxStale = maxStale
+		self.value = None
+		self.updatedAt = 0
+		self.refreshing = None
+
+	def age(self):
+		return time() - self.updatedAt
+
+
+class SnapshotStore(object):
+	def __init__(self):
+		self.snapshots = {}
+		self.scheduler = None
+
+	def register(self, name, loader, interval, maxStale=None):
+		self.snapshots[name] = Snapshot(loader, interval, interval * 10 if maxStale is None else maxStale)
+
+	async def get(self, name):
+		snapshot = self.snapshots[name]
+		if snapshot.value is None or snapshot.age() > snapshot.maxStale:
+			await self.refresh(name)
+		elif snapshot.age() > snapshot.interval:
+			# Serve the stale value while a refresh runs in the background
+			self.refresh(name)
+		return snapshot.value
+
+	def refresh(self, name):
+		snapshot = self.snapshots[name]
+		if snapshot.refreshing is None:
+			snapshot.refreshing = create_task(self._load(snapshot))
+		return shield(snapshot.refreshing)
+
+	async def _load(self, snapshot):
+		try:
+			snapshot.value = await snapshot.loader()
+			snapshot.updatedAt = time()
+		except Exception:
+			print(format_exc())
+			if snapshot.value is None: raise
+		finally:
+			snapshot.refreshing = None
+
+	async def run(self):
+		while True:
+			# Providers loaded after startup register their datasets while this loop runs
+			for name, snapshot in list(self.snapshots.items()):
+				# Only datasets that have been requested at least once are kept warm
+				if snapshot.value is not None and snapshot.refreshing is None and snapshot.age() > snapshot.interval:
+					self.refresh(name)
+			await sleep(SCHEDULER_TICK)
+
+	def start(self):
+		if self.scheduler is None:
+			self.scheduler = create_task(self.run())
+
+	async def stop(self):
+		if self.scheduler is not None:
+			self.scheduler.cancel()
+			try: await self.scheduler
+			except CancelledError: pass
+			self.scheduler = None
+
+
+snapshots = SnapshotStore()
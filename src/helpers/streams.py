@@ -0,0 +1,175 @@
+from os import environ
+from datetime import datetime, timezone
+from asyncio import Event, CancelledError, create_task, sleep
+from traceback import format_exc
+
+from orjson import dumps
+from starlette.websockets import WebSocketDisconnect
+
+from helpers.exchanges import streamExchangePool
+from helpers.candles import candleStore
+from helpers.ratelimits import get_limiter
+from helpers import providers
+
+
+CHANNELS = ["ticker", "ohlcv"]
+RETRY_DELAY = float(environ.get("STREAM_RETRY_DELAY", 5))
+MAX_SUBSCRIPTIONS = int(environ.get("STREAM_MAX_SUBSCRIPTIONS", 100))
+
+
+class Subscriber(object):
+	def __init__(self, websocket):
+		self.websocket = websocket
+		self.subscriptions = {}
+		self.pending = {}
+		self.event = Event()
+
+	def push(self, subscriptionId, payload, message):
+		# Only the latest update per subscription is kept, so slow clients skip stale prices instead of backing up
+		self.pending[subscriptionId] = {"subscription": subscriptionId, "response": payload, "message": message}
+		self.event.set()
+
+	async def run(self):
+		while True:
+			await self.event.wait()
+			self.event.clear()
+			pending, self.pending = self.pending, {}
+			for update in pending.values():
+				await self.websocket.send_bytes(dumps(update))
+
+
+class Watcher(object):
+	def __init__(self, key, ticker):
+		self.key = key
+		self.ticker = ticker
+		self.listeners = {}
+		self.task = None
+		self.latest = None
+
+	async def run(self):
+		exchangeId, symbol, channel = self.key
+		exchange = self.ticker["exchange"]
+
+		while True:
+			try:
+				# Failures to set up the stream are retried and reported like any other stream error
+				provider = await providers.load("CCXT")
+				if provider is None: raise RuntimeError("CCXT provider is not available")
+				CCXT = provider.implementation
+				ccxtInstance = await streamExchangePool.acquire(exchangeId)
+
+				if channel == "ticker":
+					rawData = await ccxtInstance.watch_ticker(symbol)
+					if rawData.get("last") is None: continue
+					self.latest = CCXT._parse_ticker(self.ticker, exchange, rawData)
+				else:
+					tf, limitTimestamp, candleOffset = CCXT.get_highest_supported_timeframe(ccxtInstance, datetime.now().astimezone(timezone.utc))
+					# The stream tops up the same buffers the quote path reads from
+					candles = candleStore.get(exchangeId, symbol, tf)
+					if len(candles) == 0:
+						await get_limiter(CCXT.name, exchangeId).acquire()
+						candles.merge(await ccxtInstance.fetch_ohlcv(symbol, timeframe=tf, since=limitTimestamp, limit=150))
+					candles.merge(await ccxtInstance.watch_ohlcv(symbol, timeframe=tf))
+					payload, message = CCXT._parse_ohlcv(self.ticker, exchange, ccxtInstance, candles, tf, candleOffset)
+					if payload is None: continue
+					self.latest = payload, message
+			except CancelledError:
+				raise
+			except:
+				print(format_exc())
+				self.latest = None
+				self.broadcast(None, f"Live data from {exchange['name']} is currently unavailable.")
+				await sleep(RETRY_DELAY)
+				continue
+
+			self.broadcast(*self.latest)
+
+	def broadcast(self, payload, message):
+		for subscriber, subscriptionId in self.listeners:
+			subscriber.push(subscriptionId, payload, message)
+
+
+class StreamHub(object):
+	def __init__(self):
+		self.watchers = {}
+		self.exchangeUsage = {}
+		# The event loop only keeps weak references to tasks, so releases are held here until they finish
+		self.releases = set()
+
+	def subscribe(self, subscriber, subscriptionId, ticker, channel):
+		exchange = ticker.get("exchange")
+		if not exchange: return "Streaming is only available for tickers listed on an exchange."
+		if exchange["id"] not in streamExchangePool.module.exchanges: return f"Streaming is not supported by {exchange['name']}."
+		if channel not in CHANNELS: return f"Unknown stream channel `{channel}`."
+		if subscriptionId in subscriber.subscriptions: self.unsubscribe(subscriber, subscriptionId)
+		if len(subscriber.subscriptions) >= MAX_SUBSCRIPTIONS: return f"A connection can hold at most {MAX_SUBSCRIPTIONS} subscriptions."
+
+		# All clients watching the same market share one upstream stream
+		key = (exchange["id"], ticker.get("symbol"), channel)
+		watcher = self.watchers.get(key)
+		if watcher is None:
+			watcher = Watcher(key, ticker)
+			watcher.task = create_task(watcher.run())
+			self.watchers[key] = watcher
+			self.exchangeUsage[exchange["id"]] = self.exchangeUsage.get(exchange["id"], 0) + 1
+
+		watcher.listeners[(subscriber, subscriptionId)] = ticker
+		subscriber.subscriptions[subscriptionId] = key
+		if watcher.latest is not None:
+			subscriber.push(subscriptionId, *watcher.latest)
+		return None
+
+	def unsubscribe(self, subscriber, subscriptionId):
+		key = subscriber.subscriptions.pop(subscriptionId, None)
+		watcher = self.watchers.get(key)
+		if watcher is None: return
+
+		watcher.listeners.pop((subscriber, subscriptionId), None)
+		if len(watcher.listeners) == 0:
+			del self.watchers[key]
+			watcher.task.cancel()
+			task = create_task(self.release(key[0]))
+			self.releases.add(task)
+			task.add_done_callback(self.releases.discard)
+
+	def unsubscribe_all(self, subscriber):
+		for subscriptionId in list(subscriber.subscriptions):
+			self.unsubscribe(subscriber, subscriptionId)
+
+	async def release(self, exchangeId):
+		self.exchangeUsage[exchangeId] -= 1
+		if self.exchangeUsage[exchangeId] == 0:
+			del self.exchangeUsage[exchangeId]
+			await streamExchangePool.release(exchangeId)
+
+	async def close(self):
+		for watcher in self.watchers.values():
+			watcher.task.cancel()
+		self.watchers, self.exchangeUsage = {}, {}
+		await streamExchangePool.close()
+
+
+hub = StreamHub()
+
+async def serve(websocket):
+	await websocket.accept()
+	await streamExchangePool.load_module()
+	subscriber = Subscriber(websocket)
+	sender = create_task(subscriber.run())
+
+	try:
+		while True:
+			request = await websocket.receive_json()
+			subscriptionId = str(request.get("id", ""))
+			if request.get("action") == "subscribe":
+				message = hub.subscribe(subscriber, subscriptionId, request.get("ticker", {}), request.get("channel", "ticker"))
+				if message is not None: subscriber.push(subscriptionId, None, message)
+			elif request.get("action") == "unsubscribe":
+				hub.unsubscribe(subscriber, subscriptionId)
+			else:
+				subscriber.push(subscriptionId, None, "Unknown stream action.")
+	except WebSocketDisconnect:
+		pass
+	finally:
+		sender.cancel()
+		hub.unsubscribe_all(subscriber)
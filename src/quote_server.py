@@ -3,47 +3,72 @@ environ["PRODUCTION"] = environ["PRODUCTION"] if "PRODUCTION" in environ and env
 
 from time import time, sleep
 from uuid import uuid4
-from fastapi import FastAPI, Request
-from uvicorn import Config, Server
-from asyncio import new_event_loop, set_event_loop
-from traceback import format_exc
+from functools import partial
+from orjson import loads
+from fastapi import FastAPI, Request, WebSocket
+from uvicorn import Config, Server, run as run_workers
+from asyncio import new_event_loop, set_event_loop, create_task, gather, wait, FIRST_COMPLETED
+from traceback import format_exc, format_exception
 
-from google.cloud.error_reporting import Client as ErrorReportingClient
+from helpers.exchanges import asyncExchangePool
+from helpers.cache import QuoteCache
+from helpers.snapshots import snapshots
+from helpers.ratelimits import requestPriority, PRIORITY_DETAIL
+from helpers import cache_index, executors, http, providers, shared, streams, metrics
 
-from components.alternativeme import Alternativeme
-from components.blockchair import Blockchair
-from components.cnnbusiness import CNNBusiness
-from components.ccxt import CCXT
-from components.coingecko import CoinGecko
-from components.chain import Chain
-from components.twelvedata import Twelvedata
+
+QUOTE_CACHE_TTLS = {
+	"Alternative.me": 0,
+	"Blockchair": 0,
+	"CNN Business": 0,
+	"CoinGecko": 30,
+	"On-Chain": 15,
+	"CCXT": 5,
+	"Twelvedata": 15,
+	**loads(environ.get("QUOTE_CACHE_TTLS", "{}"))
+}
+WORKERS = int(environ.get("WORKERS", 1))
+GRACEFUL_SHUTDOWN_TIMEOUT = int(environ.get("GRACEFUL_SHUTDOWN_TIMEOUT", 20))
+FANOUT_MODE = environ.get("QUOTE_FANOUT_MODE", "sequential")
+RACE_WIDTH = int(environ.get("QUOTE_RACE_WIDTH", 2))
+# Platforms are hedged after their registered latency hint unless overridden here
+HEDGE_BUDGETS = loads(environ.get("QUOTE_HEDGE_BUDGETS", "{}"))
 
 
 app = FastAPI()
-logging = ErrorReportingClient(service="details_server")
+app.mount("/metrics", metrics.make_app())
 loop = new_event_loop()
 set_event_loop(loop)
+quoteCache = QuoteCache(QUOTE_CACHE_TTLS, defaultTtl=5, maxSize=int(environ.get("QUOTE_CACHE_SIZE", 10000)))
+
+async def fetch_quote(platform, request):
+	provider = await providers.load(platform)
+	if provider is None: return {}, None
+	return await provider.request_quote(request)
+
+async def fetch_quote_batch(platform, requests):
+	provider = await providers.load(platform)
+	if provider is None: return [({}, None)] * len(requests)
+	return await provider.request_quotes(requests)
+
+def hedge_budget(platform):
+	if platform in HEDGE_BUDGETS: return HEDGE_BUDGETS[platform]
+	# Providers still importing are hedged after the default budget
+	provider = providers.registry.get(platform)
+	return providers.DEFAULT_LATENCY if provider is None else provider.latency
 
 async def request_quote(request):
+	if FANOUT_MODE == "hedged":
+		return await request_quote_hedged(request, 1)
+	elif FANOUT_MODE == "race":
+		return await request_quote_hedged(request, RACE_WIDTH)
+
 	payload, finalMessage, message = {}, None, None
 
 	for platform in request["platforms"]:
 		currentRequest = request.get(platform)
 
-		if platform == "Alternative.me":
-			payload, message = await loop.run_in_executor(None, Alternativeme.request_quote, currentRequest)
-		elif platform == "Blockchair":
-			payload, message = await loop.run_in_executor(None, Blockchair.request_quote, currentRequest)
-		elif platform == "CNN Business":
-			payload, message = await loop.run_in_executor(None, CNNBusiness.request_quote, currentRequest)
-		elif platform == "CoinGecko":
-			payload, message = await loop.run_in_executor(None, CoinGecko.request_quote, currentRequest)
-		elif platform == "On-Chain":
-			payload, message = await loop.run_in_executor(None, Chain.request_quote, currentRequest)
-		elif platform == "CCXT":
-			payload, message = await loop.run_in_executor(None, CCXT.request_quote, currentRequest)
-		elif platform == "Twelvedata":
-			payload, message = await loop.run_in_executor(None, Twelvedata.request_quote, currentRequest)
+		payload, message = await quoteCache.fetch(platform, currentRequest, partial(fetch_quote, platform, currentRequest))
 
 		if bool(payload):
 			return {"response": payload, "message": message}
@@ -52,16 +77,133 @@ async def request_quote(request):
 
 	return {"response": None, "message": finalMessage}
 
+async def request_quote_hedged(request, initialWidth):
+	platforms = request["platforms"]
+	messages = {}
+	pending = {}
+
+	def launch():
+		index = len(messages) + len(pending)
+		platform = platforms[index]
+		currentRequest = request.get(platform)
+		task = create_task(quoteCache.fetch(platform, currentRequest, partial(fetch_quote, platform, currentRequest)))
+		pending[task] = index
+
+	for _ in range(min(initialWidth, len(platforms))):
+		launch()
+
+	try:
+		while len(pending) != 0:
+			hasNext = len(messages) + len(pending) < len(platforms)
+			# The next platform starts once the latest one has used up its latency budget
+			budget = hedge_budget(platforms[max(pending.values())]) if hasNext else None
+			done, _ = await wait(pending.keys(), timeout=budget, return_when=FIRST_COMPLETED)
+
+			if len(done) == 0:
+				launch()
+				continue
+
+			for task in sorted(done, key=lambda task: pending[task]):
+				index = pending.pop(task)
+				try:
+					payload, message = task.result()
+				except:
+					print(format_exc())
+					payload, message = None, None
+				if bool(payload):
+					return {"response": payload, "message": message}
+				messages[index] = message
+
+			if len(pending) == 0 and len(messages) < len(platforms):
+				launch()
+	finally:
+		# Cancelled lookups keep running inside the quote cache, so their results still warm it
+		for task in pending:
+			task.cancel()
+
+	finalMessage = None
+	for index in sorted(messages):
+		if messages[index] is not None:
+			finalMessage = messages[index]
+	return {"response": None, "message": finalMessage}
+
+async def fetch_quote_group(platform, requests):
+	ttl = quoteCache.ttl(platform)
+	responses = {}
+	if ttl > 0:
+		for key in requests:
+			cached = quoteCache.get(key)
+			if cached is not None: responses[key] = cached
+
+	misses = [key for key in requests if key not in responses]
+	if ttl > 0:
+		metrics.cacheLookups.labels("quotes", platform, "hit").inc(len(responses))
+		metrics.cacheLookups.labels("quotes", platform, "miss").inc(len(misses))
+		if len(misses) != 0:
+			responses.update(await quoteCache.get_shared(platform, misses))
+			misses = [key for key in misses if key not in responses]
+	if len(misses) != 0:
+		fetched = {}
+		for key, response in zip(misses, await fetch_quote_batch(platform, [requests[key] for key in misses])):
+			responses[key] = response
+			if ttl > 0 and bool(response[0]):
+				quoteCache.set(key, response, ttl)
+				fetched[key] = response
+		await quoteCache.set_shared(fetched, ttl)
+	return responses
+
+async def request_quotes(requests):
+	results = [None] * len(requests)
+	finalMessages = [None] * len(requests)
+	cursors = [0] * len(requests)
+	remaining = list(range(len(requests)))
+
+	while len(remaining) != 0:
+		# Requests are grouped by their current platform and deduplicated on their cache key
+		groups, members = {}, []
+		for i in remaining:
+			platforms = requests[i]["platforms"]
+			if cursors[i] == len(platforms):
+				results[i] = {"response": None, "message": finalMessages[i]}
+				continue
+			platform = platforms[cursors[i]]
+			currentRequest = requests[i].get(platform)
+			key = QuoteCache.key(platform, currentRequest)
+			groups.setdefault(platform, {}).setdefault(key, currentRequest)
+			members.append((i, platform, key))
+
+		platforms = list(groups.keys())
+		responses = {}
+		for platform, response in zip(platforms, await gather(*[fetch_quote_group(platform, groups[platform]) for platform in platforms], return_exceptions=True)):
+			if isinstance(response, Exception):
+				# A failing platform only sends its own requests on to their next platform
+				print("".join(format_exception(response)))
+				response = {key: (None, None) for key in groups[platform]}
+			elif isinstance(response, BaseException):
+				raise response
+			responses[platform] = response
+
+		remaining = []
+		for i, platform, key in members:
+			payload, message = responses[platform][key]
+			if bool(payload):
+				results[i] = {"response": payload, "message": message}
+			else:
+				if message is not None: finalMessages[i] = message
+				cursors[i] += 1
+				remaining.append(i)
+
+	return results
+
 async def request_detail(request):
 	payload, finalMessage, message = {}, None, None
 
 	for platform in request["platforms"]:
 		currentRequest = request.get(platform)
 
-		if platform == "CoinGecko":
-			payload, message = await loop.run_in_executor(None, CoinGecko.request_details, currentRequest)
-		elif platform == "Twelvedata":
-			payload, message = await loop.run_in_executor(None, Twelvedata.request_details, currentRequest)
+		provider = await providers.load(platform)
+		if provider is not None:
+			payload, message = await provider.request_details(currentRequest)
 
 		if bool(payload):
 			return {"response": payload, "message": message}
@@ -70,19 +212,51 @@ async def request_detail(request):
 
 	return {"response": None, "message": finalMessage}
 
+@app.on_event("startup")
+async def startup():
+	snapshots.start()
+	providers.start_warm_up()
+
+@app.on_event("shutdown")
+async def shutdown():
+	await snapshots.stop()
+	await streams.hub.close()
+	await asyncExchangePool.close()
+	await cache_index.close()
+	await http.close()
+	await shared.close()
+	executors.close()
+	metrics.close()
+
 @app.post("/quote")
 async def run(req: Request):
 	request = await req.json()
 	return await request_quote(request)
 
+@app.post("/quotes")
+async def run(req: Request):
+	request = await req.json()
+	return await request_quotes(request["requests"])
+
+@app.websocket("/stream")
+async def run(websocket: WebSocket):
+	await streams.serve(websocket)
+
 @app.post("/detail")
 async def run(req: Request):
 	request = await req.json()
+	# Detail lookups yield upstream capacity to quotes when a rate limit is saturated
+	requestPriority.set(PRIORITY_DETAIL)
 	return await request_detail(request)
 
 if __name__ == "__main__":
 	print("[Startup]: Quote Server is online")
 	# config = Config(app=app, port=int(environ.get("PORT", 8080)), host="0.0.0.0", loop=loop)
-	config = Config(app=app, port=6900, host="0.0.0.0", loop=loop)
-	server = Server(config)
-	loop.run_until_complete(server.serve())
\ No newline at end of file
+	if WORKERS > 1:
+		# Every worker imports the app on its own event loop; SIGHUP restarts them one at a time
+		metrics.prepare_multiprocess()
+		run_workers("quote_server:app", port=6900, host="0.0.0.0", workers=WORKERS, timeout_graceful_shutdown=GRACEFUL_SHUTDOWN_TIMEOUT)
+	else:
+		config = Config(app=app, port=6900, host="0.0.0.0", loop=loop, timeout_graceful_shutdown=GRACEFUL_SHUTDOWN_TIMEOUT)
+		server = Server(config)
+		loop.run_until_complete(server.serve())
\ No newline at end of file